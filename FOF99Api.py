@@ -7,8 +7,10 @@ from mall_sdk.fof99 import (
     GmFundPrice,
     CompanyInfo,
 )
+from mall_sdk.fof99.requests.baserequest import BaseRequest
 import pandas as pd
 from config import APPID, APPKEY
+from utils import get_http_session
 
 
 class FOF99Api:
@@ -16,17 +18,26 @@ class FOF99Api:
     appkey: str = APPKEY
     token: str = ""
 
-    def __init__(self):
-        pass
+    def __init__(self, http=None):
+        """
+        :param http: 发送请求的对象, 默认为共用连接池的 get_http_session(), 启用时使用 HTTP 响应缓存(缓存键忽略 sign 参数)
+        """
+        self.http = get_http_session() if http is None else http
+
+    def _request(self, request_class) -> BaseRequest:
+        """创建请求对象, 只对该请求实例设置 http, 不修改 SDK 的类属性"""
+        req = request_class(self.appid, self.appkey)
+        req._http = self.http
+        return req
 
     def get_fund_info(self, reg_code: str = "SVZ009"):
-        req = FundInfo(self.appid, self.appkey)  # 请求对
+        req = self._request(FundInfo)  # 请求对
         req.set_params(reg_code)
         res = req.do_request(use_df=False)
         return res
 
     def get_company_info(self, reg_code: str = "P1002305"):
-        req = CompanyInfo(self.appid, self.appkey)  # 请求对
+        req = self._request(CompanyInfo)  # 请求对
         req.set_params(reg_code)
         res = req.do_request(use_df=False)
         return res
@@ -36,7 +47,7 @@ class FOF99Api:
         reg_code: str = "SVZ009",
         start_date: str = "2010-01-01",
     ):
-        req = FundPrice(self.appid, self.appkey)  # 请求对
+        req = self._request(FundPrice)  # 请求对
         req.set_params(reg_code=reg_code, start_date=start_date)
         res = req.do_request(use_df=True)
         return res
@@ -46,7 +57,7 @@ class FOF99Api:
         fid: str = "381719",
         start_date: str = "2010-01-01",
     ):
-        req = PersonFundPrice(self.appid, self.appkey)  # 请求对
+        req = self._request(PersonFundPrice)  # 请求对
         req.set_params(fid=fid, start_date=start_date)
         res = req.do_request(use_df=True)
         return res
@@ -56,7 +67,7 @@ class FOF99Api:
         reg_code: str = "JX919A",
         start_date: str = "2010-01-01",
     ):
-        req = FundCompanyPrice(self.appid, self.appkey)  # 请求对
+        req = self._request(FundCompanyPrice)  # 请求对
         req.set_params(reg_code=reg_code, start_date=start_date)
         res = req.do_request(use_df=True)
         return res
@@ -66,7 +77,7 @@ class FOF99Api:
         reg_code="022461",
         start_date: str = "2010-01-01",
     ) -> pd.DataFrame:
-        req = GmFundPrice(self.appid, self.appkey)  # 请求对
+        req = self._request(GmFundPrice)  # 请求对
         req.set_params(str(reg_code).zfill(6), start_date=start_date)
         res = req.do_request(use_df=True)
         return res
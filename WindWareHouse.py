@@ -1,13 +1,26 @@
+import os
+import time
+from datetime import datetime
 import pandas as pd
 import numpy as np
 from WindPy import w
 from typing import Literal
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from trading_calendar import get_trading_calendar
 
 # modify date: 2025-8-1
 # modify by: Euclid-Jie
 # description: 删掉了F-String的使用
 
+# Maximum number of cells (codes x days) requested in a single multi-code wsd call.
+WSD_MAX_CELLS = 100000
+# Intraday downloads are split into chunks of this many trading days.
+INTRADAY_CHUNK_DAYS = 20
+INTRADAY_MAX_WORKERS = 2
+INTRADAY_RETRIES = 3
+
+
 class WindWareHouse:
     def __init__(self) -> None:
         """
@@ -108,6 +121,222 @@ class WindWareHouse:
             data.index = [np.datetime_as_string(begin_date, unit="D")]
         return data
 
+    @staticmethod
+    def _wsd_columns(
+        codes: str, fields: str, begin_date: np.datetime64, end_date: np.datetime64, columns: dict
+    ):
+        """
+        Call wsd and relabel its columns by name.
+
+        Args:
+            codes (str): Comma-separated codes passed to wsd.
+            fields (str): Comma-separated fields passed to wsd.
+            begin_date (np.datetime64): The start date of the data.
+            end_date (np.datetime64): The end date of the data.
+            columns (dict): Upper-cased column name Wind returns -> label to use.
+
+        Returns:
+            pd.DataFrame: The wsd frame indexed by date, with columns in the order of `columns`.
+
+        Raises:
+            RuntimeError: If Wind returns a non-zero error code or columns other than expected.
+        """
+        err, data = w.wsd(
+            codes,
+            fields,
+            WindWareHouse.wind_datetime_covert(begin_date, "D"),
+            WindWareHouse.wind_datetime_covert(end_date, "D"),
+            PriceAdj="F",
+            usedf=True,
+        )
+        if err != 0:
+            raise RuntimeError(
+                "wsd {} {} failed with error code {}".format(fields, codes, err)
+            )
+        if len(data) == 1 and begin_date == end_date:
+            data.index = [np.datetime_as_string(begin_date, unit="D")]
+        returned = [str(column).upper() for column in data.columns]
+        if set(returned) != set(columns):
+            raise RuntimeError(
+                "wsd {} {} returned columns {}, expected {}".format(
+                    fields, codes, list(data.columns), list(columns)
+                )
+            )
+        data.columns = [columns[column] for column in returned]
+        return data[list(columns.values())]
+
+    @staticmethod
+    def get_data_batch(
+        codes: list[str],
+        fields: str = "open,close,high,low,volume",
+        begin_date: np.datetime64 = np.datetime64("2020-06-06"),
+        end_date: np.datetime64 = np.datetime64("today"),
+        max_cells: int = WSD_MAX_CELLS,
+    ):
+        """
+        Get daily data for many codes sharing the same date range.
+
+        Wind only accepts a single field when wsd is called with multiple codes, so one
+        multi-code request is issued per field. When there are no more codes than fields,
+        one multi-field request per code takes fewer calls and is used instead. Requests are
+        split by code (and by date for very long ranges) so that cells per call stay within
+        max_cells.
+
+        Args:
+            codes (list[str]): The codes of the ETF/Stock/Index.
+            fields (str, optional): The fields of the data. Defaults to "open,close,high,low,volume".
+            begin_date (np.datetime64, optional): The start date of the data. Defaults to np.datetime64("2020-06-06").
+            end_date (np.datetime64, optional): The end date of the data. Defaults to np.datetime64("today").
+            max_cells (int, optional): The maximum number of cells per request. Defaults to WSD_MAX_CELLS.
+
+        Returns:
+            pd.DataFrame: Long frame with columns date, code and one upper-case column per field,
+                one row per (code, date).
+
+        Raises:
+            RuntimeError: If Wind returns a non-zero error code or columns other than requested.
+        """
+        begin_date = np.datetime64(begin_date, "D")
+        end_date = np.datetime64(end_date, "D")
+        field_list = fields.split(",")
+        per_code = len(codes) <= len(field_list)
+        # Weekdays are a close enough upper bound of the trading days in the range.
+        n_days = max(int(np.busday_count(begin_date, end_date + np.timedelta64(1, "D"))), 1)
+        width = len(field_list) if per_code else 1
+        days_per_call = max(min(n_days, max_cells // width), 1)
+        codes_per_call = 1 if per_code else max(max_cells // days_per_call, 1)
+        date_ranges = []
+        chunk_begin = begin_date
+        while chunk_begin <= end_date:
+            chunk_end = min(
+                np.busday_offset(chunk_begin, days_per_call - 1, roll="forward"),
+                end_date,
+            )
+            date_ranges.append((chunk_begin, chunk_end))
+            chunk_begin = chunk_end + np.timedelta64(1, "D")
+
+        if per_code:
+            parts = []
+            for code in codes:
+                for chunk_begin, chunk_end in date_ranges:
+                    data = WindWareHouse._wsd_columns(
+                        code,
+                        fields,
+                        chunk_begin,
+                        chunk_end,
+                        {field.upper(): field.upper() for field in field_list},
+                    )
+                    data.index = pd.MultiIndex.from_product([data.index, [code]])
+                    parts.append(data)
+            data = pd.concat(parts)
+        else:
+            columns = {}
+            for field in field_list:
+                parts = []
+                for i in range(0, len(codes), codes_per_call):
+                    code_chunk = codes[i : i + codes_per_call]
+                    for chunk_begin, chunk_end in date_ranges:
+                        # A single code comes back with the field as the column name;
+                        # several codes come back one column per code.
+                        data = WindWareHouse._wsd_columns(
+                            ",".join(code_chunk),
+                            field,
+                            chunk_begin,
+                            chunk_end,
+                            {field.upper(): code_chunk[0]}
+                            if len(code_chunk) == 1
+                            else {code.upper(): code for code in code_chunk},
+                        )
+                        parts.append(data.stack(future_stack=True))
+                columns[field.upper()] = pd.concat(parts)
+            data = pd.DataFrame(columns)
+        data.index.names = ["date", "code"]
+        data = data.reset_index(drop=False)
+        data["date"] = pd.to_datetime(data["date"])
+        return data.sort_values(["code", "date"]).reset_index(drop=True)
+
+    @staticmethod
+    def intraday_chunks(
+        begin_date: np.datetime64,
+        end_date: np.datetime64,
+        chunk_days: int = INTRADAY_CHUNK_DAYS,
+    ):
+        """
+        Split an intraday range into chunks aligned to trading days.
+
+        Args:
+            begin_date (np.datetime64): The start datetime of the range.
+            end_date (np.datetime64): The end datetime of the range. A date means 15:00 of that day.
+            chunk_days (int, optional): Trading days per chunk. Defaults to INTRADAY_CHUNK_DAYS.
+
+        Returns:
+            list[tuple[np.datetime64, np.datetime64]]: (begin, end) datetimes of each chunk. A chunk starts
+                at 00:00 of its first trading day and ends one second before the next chunk starts, so
+                night-session bars (21:00 to the early morning) stay in the chunk of their trading day's
+                evening. The first and last chunks keep the requested bounds.
+        """
+        if end_date.dtype == "M8[D]":
+            end_date = end_date + np.timedelta64(15, "h")
+        begin_date = np.datetime64(begin_date, "s")
+        end_date = np.datetime64(end_date, "s")
+        days = get_trading_calendar().trading_days_between(
+            begin_date.astype("datetime64[D]"), end_date.astype("datetime64[D]")
+        )
+        starts = [np.datetime64(day, "s") for day in days[::chunk_days]]
+        chunks = []
+        for i, chunk_begin in enumerate(starts):
+            chunk_end = (
+                starts[i + 1] - np.timedelta64(1, "s")
+                if i + 1 < len(starts)
+                else end_date
+            )
+            chunks.append((max(chunk_begin, begin_date), chunk_end))
+        return chunks
+
+    @staticmethod
+    def _get_intraday_chunk(
+        code: str,
+        begin_date: np.datetime64,
+        end_date: np.datetime64,
+        freq: str,
+        fields: str,
+        retries: int = INTRADAY_RETRIES,
+    ):
+        """
+        Fetch one chunk with a single wsi call, retrying with exponential backoff.
+
+        Raises:
+            RuntimeError: If every attempt fails.
+        """
+        for attempt in range(retries):
+            try:
+                err, data = w.wsi(
+                    code,
+                    fields,
+                    WindWareHouse.wind_datetime_covert(begin_date, "dt"),
+                    WindWareHouse.wind_datetime_covert(end_date, "dt"),
+                    PriceAdj="F",
+                    options="BarSize={}".format(int(freq[:-1])),
+                    usedf=True,
+                )
+                if err == 0:
+                    return data
+                message = "error code {}".format(err)
+            except Exception as e:
+                message = str(e)
+            print(
+                "wsi {} {} ~ {} failed ({}), attempt {}/{}".format(
+                    code, begin_date, end_date, message, attempt + 1, retries
+                )
+            )
+            if attempt < retries - 1:
+                time.sleep(2**attempt)
+        raise RuntimeError(
+            "wsi {} {} ~ {} failed after {} attempts".format(
+                code, begin_date, end_date, retries
+            )
+        )
+
     @staticmethod
     def get_data_intraday(
         code: str = "510050.SH",
@@ -115,10 +344,15 @@ class WindWareHouse:
         end_date: np.datetime64 = np.datetime64("today"),
         freq: Literal["60M", "30M", "15M", "10M", "5M", "1M"] = "5M",
         fields: str = "open,close,high,low,volume",
+        chunk_days: int = INTRADAY_CHUNK_DAYS,
+        max_workers: int = INTRADAY_MAX_WORKERS,
     ):
         """
         Get intraday ETF/Stock data.
 
+        The range is split into trading-day chunks fetched in parallel, each retried on failure.
+        For long ranges use download_intraday, which writes chunks to disk instead of memory.
+
         Args:
             code (str, optional): The code of the ETF/Stock. Defaults to "510050.SH".
             begin_date (np.datetime64, optional): The start date of the data. Defaults to np.datetime64("2024-06-06 10:00").
@@ -127,22 +361,150 @@ class WindWareHouse:
                 "60M" for hourly, "30M" for every 30 minutes, "15M" for every 15 minutes,
                 "10M" for every 10 minutes, "5M" for every 5 minutes, "1M" for every 1 minute.
                 Defaults to "5M".
+            chunk_days (int, optional): Trading days per wsi call. Defaults to INTRADAY_CHUNK_DAYS.
+            max_workers (int, optional): Concurrent wsi calls. Defaults to INTRADAY_MAX_WORKERS.
 
         Returns:
             pd.DataFrame: The intraday ETF/Stock data.
         """
-        if end_date.dtype == "M8[D]":
-            end_date = end_date + np.timedelta64(15, "h")
-        _, data = w.wsi(
-            code,
-            fields,
-            WindWareHouse.wind_datetime_covert(begin_date, "dt"),
-            WindWareHouse.wind_datetime_covert(end_date, "dt"),
-            PriceAdj="F",
-            options=f"BarSize={int(freq[:-1])}",
-            usedf=True,
+        chunks = WindWareHouse.intraday_chunks(begin_date, end_date, chunk_days)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parts = list(
+                executor.map(
+                    lambda chunk: WindWareHouse._get_intraday_chunk(
+                        code, chunk[0], chunk[1], freq, fields
+                    ),
+                    chunks,
+                )
+            )
+        return pd.concat(parts) if parts else pd.DataFrame()
+
+    @staticmethod
+    def _download_intraday_chunk(
+        code: str,
+        chunk_begin: np.datetime64,
+        chunk_end: np.datetime64,
+        freq: str,
+        fields: str,
+        path: Path,
+    ):
+        """
+        Fetch one chunk and write it to its partition, so the data is released in the worker.
+
+        Returns:
+            Path | None: The partition path if the chunk failed after all retries, else None.
+        """
+        try:
+            data = WindWareHouse._get_intraday_chunk(
+                code, chunk_begin, chunk_end, freq, fields
+            )
+        except RuntimeError as e:
+            print(e)
+            return path
+        data.index.name = "datetime"
+        data["code"] = code
+        tmp_path = path.with_suffix(".tmp")
+        data.reset_index(drop=False).to_csv(tmp_path, index=False, encoding="utf-8-sig")
+        os.replace(tmp_path, path)
+        return None
+
+    @staticmethod
+    def download_intraday(
+        code: str,
+        begin_date: np.datetime64,
+        end_date: np.datetime64,
+        freq: Literal["60M", "30M", "15M", "10M", "5M", "1M"] = "1M",
+        fields: str = "open,close,high,low,volume",
+        output_dir: Path = Path("data"),
+        chunk_days: int = INTRADAY_CHUNK_DAYS,
+        max_workers: int = INTRADAY_MAX_WORKERS,
+    ):
+        """
+        Download intraday data to one CSV partition per trading-day chunk.
+
+        Partitions are written to output_dir/code/freq/ as each chunk arrives, through a
+        temporary file and an atomic rename by the worker that fetched them, so only the chunks
+        in flight are held in memory and memory use is bounded by max_workers chunks.
+        Existing partitions are skipped, which makes an interrupted download resumable. A chunk
+        whose end is still in the future (e.g. today before the close) is not downloaded, since
+        a partial partition would never be refreshed; rerun after the range has closed.
+
+        Args:
+            code (str): The code of the ETF/Stock.
+            begin_date (np.datetime64): The start datetime of the data.
+            end_date (np.datetime64): The end datetime of the data.
+            freq (Literal["60M", "30M", "15M", "10M", "5M", "1M"], optional): The frequency of the data.
+                Defaults to "1M".
+            fields (str, optional): The fields of the data. Defaults to "open,close,high,low,volume".
+            output_dir (Path, optional): Root folder of the partitions. Defaults to Path("data").
+            chunk_days (int, optional): Trading days per partition. Defaults to INTRADAY_CHUNK_DAYS.
+            max_workers (int, optional): Concurrent wsi calls. Defaults to INTRADAY_MAX_WORKERS.
+
+        Returns:
+            list[Path]: Partition files covering the range, in date order. Chunks that failed
+                after all retries or have not closed yet are reported and left out, so a rerun
+                fetches only them.
+        """
+        folder = Path(output_dir).joinpath(code, freq)
+        folder.mkdir(parents=True, exist_ok=True)
+        partitions = {}
+        for chunk_begin, chunk_end in WindWareHouse.intraday_chunks(
+            begin_date, end_date, chunk_days
+        ):
+            name = "{}_{}.csv".format(
+                np.datetime_as_string(chunk_begin, unit="m").replace(":", ""),
+                np.datetime_as_string(chunk_end, unit="m").replace(":", ""),
+            )
+            partitions[folder.joinpath(name)] = (chunk_begin, chunk_end)
+        now = np.datetime64(datetime.now(), "s")
+        pending = [path for path, (_, chunk_end) in partitions.items() if chunk_end > now]
+        missing = [
+            path for path in partitions if not path.exists() and path not in pending
+        ]
+        print(
+            "{} {}: {} partitions, {} to download, {} not closed yet".format(
+                code, freq, len(partitions), len(missing), len(pending)
+            )
+        )
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    WindWareHouse._download_intraday_chunk,
+                    code,
+                    partitions[path][0],
+                    partitions[path][1],
+                    freq,
+                    fields,
+                    path,
+                )
+                for path in missing
+            ]
+            for future in as_completed(futures):
+                path = future.result()
+                if path is not None:
+                    failed.append(path)
+        if failed:
+            print("{} partitions failed, rerun to resume: {}".format(len(failed), failed))
+        return [
+            path for path in partitions if path not in failed and path not in pending
+        ]
+
+    @staticmethod
+    def read_intraday(partitions: list[Path]):
+        """
+        Read partitions written by download_intraday into one DataFrame.
+
+        Args:
+            partitions (list[Path]): Partition files, e.g. the return value of download_intraday.
+
+        Returns:
+            pd.DataFrame: The intraday data in date order.
+        """
+        return pd.concat(
+            (pd.read_csv(path, encoding="utf-8-sig") for path in partitions),
+            ignore_index=True,
         )
-        return data
 
     def get_option_code(
         self,
@@ -212,17 +574,13 @@ if __name__ == "__main__":
     #     end_date=np.datetime64("2024-01-02"),
     #     freq="60M",
     # )
-    data = demo.get_data(
+    # 1-minute bars for a year are downloaded chunk by chunk into data/<code>/1M/
+    partitions = demo.download_intraday(
         code="10008482.SH",
         fields="close,open,high,low,volume,amt,chg,pct_chg,oi",
         begin_date=np.datetime64("2023-01-02"),
         end_date=np.datetime64("2024-01-02"),
         freq="1M",
+        output_dir=Path("data"),
     )
-    save_foler = Path("data")
-    save_foler.mkdir(parents=True, exist_ok=True)
-    data.to_csv(
-        save_foler.joinpath("{}.csv".format(data["code"].values[0])),
-        index=False,
-        encoding="utf-8-sig",
-    )
+    print("{} partitions saved".format(len(partitions)))
@@ -0,0 +1,90 @@
+import re
+import unicodedata
+import pandas as pd
+from sqlalchemy import text
+from utils import get_all_managers, upsert_dataframe
+
+# 中基协私募管理人名录的本地镜像表, 以登记编号为主键
+MIRROR_TABLE = "amac_manager_info"
+
+
+def sync_manager_directory(engine, max_workers: int = 4):
+    """
+    从中基协拉取完整的管理人名录, 按登记编号合并写入镜像表
+    只有新增或信息有变化的管理人会被写入, 返回 upsert_dataframe 的统计结果
+    """
+    print("--- 同步中基协管理人名录 ---")
+    managers = get_all_managers(max_workers=max_workers)
+    if managers.empty:
+        print("未获取到管理人名录, 跳过同步。")
+        return None
+    return upsert_dataframe(engine, managers, MIRROR_TABLE, ["registerNo"])
+
+
+def load_manager_directory(engine, refresh: bool = True, max_workers: int = 4):
+    """读取镜像表并构建内存索引, refresh 为 True 时先同步一次"""
+    if refresh:
+        sync_manager_directory(engine, max_workers=max_workers)
+    data = pd.read_sql_query(text(f"SELECT * FROM `{MIRROR_TABLE}`"), engine)
+    print(f"镜像表 {MIRROR_TABLE} 共 {len(data)} 家管理人")
+    return ManagerDirectory(data)
+
+
+def normalize_name(name) -> str:
+    """管理人名称归一化: 全角转半角(含括号), 去掉所有空白, 英文小写"""
+    if not isinstance(name, str):
+        return ""
+    name = unicodedata.normalize("NFKC", name)
+    return re.sub(r"\s+", "", name).lower()
+
+
+class ManagerDirectory:
+    """
+    管理人名录的内存索引
+    支持按登记编号、管理人全称精确查找, 以及按归一化名称查找
+    """
+
+    def __init__(self, data: pd.DataFrame):
+        self.data = data.reset_index(drop=True)
+        self._by_register_no = self._build_index(self.data["registerNo"])
+        self._by_name = self._build_index(self.data["managerName"])
+        self._by_normalized_name = self._build_index(
+            self.data["managerName"].map(normalize_name)
+        )
+
+    @staticmethod
+    def _build_index(keys: pd.Series) -> pd.Series:
+        """key -> 行号, 出现多次的 key 有歧义, 不放入索引"""
+        keys = keys[keys.notna() & (keys != "")]
+        keys = keys[~keys.duplicated(keep=False)]
+        return pd.Series(keys.index, index=keys.values)
+
+    def _positions(self, names: pd.Series) -> pd.Series:
+        positions = names.map(self._by_name)
+        missing = positions.isna()
+        positions[missing] = (
+            names[missing].map(normalize_name).map(self._by_normalized_name)
+        )
+        return positions
+
+    def lookup(self, name: str = None, register_no: str = None):
+        """按登记编号或名称查找单个管理人, 找不到返回 None"""
+        if register_no is not None:
+            position = self._by_register_no.get(register_no)
+        else:
+            position = self._positions(pd.Series([name])).iloc[0]
+        if position is None or pd.isna(position):
+            return None
+        return self.data.iloc[int(position)]
+
+    def resolve(self, names: pd.Series) -> pd.DataFrame:
+        """
+        批量按名称查找, 返回与 names 索引一致的 DataFrame, 找不到的行全部为空
+        """
+        positions = self._positions(pd.Series(names.values, index=names.index))
+        found = positions.notna()
+        result = pd.DataFrame(index=names.index, columns=self.data.columns)
+        result.loc[found] = self.data.iloc[
+            positions[found].astype(int).values
+        ].values
+        return result
@@ -1,11 +1,32 @@
+import argparse
 import sqlalchemy
-import requests
 import pandas as pd
 import numpy as np
 from sqlalchemy import text
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from config import HUOFUNIU_TOKEN
-from utils import connect_to_database
+from utils import connect_to_database, http_get, source_slot, upsert_dataframe
+
+URL_DICT = {
+    "cne5": "https://pyapi.huofuniu.com/pyapi/factor/price?mod=cne5_style&sd={}&ed={}",
+    "cne6": "https://pyapi.huofuniu.com/pyapi/factor/price?mod=cne6_style_new&sd={}&ed={}",
+    "future": "https://pyapi.huofuniu.com/pyapi/factor/price?mod=future_new&plate=&sd={}&ed={}",
+}
+# 区间较长时按自然日切分成多段并发请求
+CHUNK_DAYS = 180
+MAX_WORKERS = 8
+# 长表存储: 每行一个 (因子类别, 因子, 日期) 的收益, 新增因子不需要改表结构
+LONG_TABLE = "factor_returns"
+LONG_KEY = ["factor_family", "factor", "date"]
+LONG_DTYPE = {
+    "factor_family": sqlalchemy.types.String(16),
+    "factor": sqlalchemy.types.String(64),
+    "date": sqlalchemy.types.Date,
+    "return": sqlalchemy.types.Float(53),
+}
+# 长表为空时从该日期开始全量获取
+LONG_START_DATE = "2010-01-01"
 
 
 def get_latest_date(engine, table_name):
@@ -23,53 +44,182 @@ def get_latest_date(engine, table_name):
     return latest_dates_df.iloc[0]["latest_date"]
 
 
-def main():
+def get_latest_long_date(engine, factor_family):
+    """长表中该因子类别的最新日期, 表不存在或没有数据时返回 None"""
+    try:
+        with engine.connect() as connection:
+            latest_date = connection.execute(
+                text(
+                    f"SELECT MAX(`date`) FROM `{LONG_TABLE}` WHERE `factor_family` = :factor_family"
+                ),
+                {"factor_family": factor_family},
+            ).scalar()
+    except Exception as e:
+        print(f"读取{LONG_TABLE}的最新日期失败, 将全量获取: {e}")
+        return None
+    return None if latest_date is None else pd.Timestamp(latest_date)
+
+
+def write_long(engine, factor_family, long_df):
+    """按 (factor_family, factor, date) 合并写入长表, 重复运行不会产生重复数据"""
+    data = long_df.rename(columns={"日期": "date"})
+    data.insert(0, "factor_family", factor_family)
+    data["date"] = data["date"].dt.date
+    return upsert_dataframe(engine, data, LONG_TABLE, LONG_KEY, dtype=LONG_DTYPE)
+
+
+def read_factor_returns(
+    engine, factor_family, start_date=None, end_date=None, factors: list[str] = None
+):
+    """
+    从长表读取一个因子类别在 [start_date, end_date] 内的收益, 透视为与宽表相同格式的 DataFrame
+    :param factors: 只读取这些因子, 为 None 时读取全部
+    """
+    query = f"SELECT `factor`, `date`, `return` FROM `{LONG_TABLE}` WHERE `factor_family` = :factor_family"
+    params = {"factor_family": factor_family}
+    if start_date is not None:
+        query += " AND `date` >= :start_date"
+        params["start_date"] = pd.Timestamp(start_date).date()
+    if end_date is not None:
+        query += " AND `date` <= :end_date"
+        params["end_date"] = pd.Timestamp(end_date).date()
+    if factors:
+        query += " AND `factor` IN :factors"
+        params["factors"] = list(factors)
+    statement = text(query)
+    if factors:
+        statement = statement.bindparams(sqlalchemy.bindparam("factors", expanding=True))
+    long_df = pd.read_sql_query(statement, engine, params=params)
+    long_df = long_df.rename(columns={"date": "日期"})
+    long_df["日期"] = pd.to_datetime(long_df["日期"])
+    return to_wide(long_df)
+
+
+def date_chunks(start_date, end_date, chunk_days: int = CHUNK_DAYS):
+    """把 [start_date, end_date] 切分成不超过 chunk_days 天的连续区间, 日期为 YYYY-MM-DD 字符串"""
+    starts = np.arange(
+        np.datetime64(start_date),
+        np.datetime64(end_date) + np.timedelta64(1, "D"),
+        chunk_days,
+    )
+    ends = np.minimum(
+        starts + np.timedelta64(chunk_days - 1, "D"), np.datetime64(end_date)
+    )
+    return list(
+        zip(
+            np.datetime_as_string(starts, unit="D"),
+            np.datetime_as_string(ends, unit="D"),
+        )
+    )
+
+
+def fetch_factor_returns(url, start_date, end_date, headers):
+    """
+    获取一个区间的因子收益, 返回长表(日期, factor, return), 没有数据时返回None
+    接口返回 {因子名: [{"date": ..., "return": ...}, ...]}
+    """
+    print(f"Fetching data from {url.format(start_date, end_date)}")
+    with source_slot("huofuniu"):
+        data = http_get(url.format(start_date, end_date), headers=headers).json()[
+            "data"
+        ]
+    if not data:
+        return None
+    long_df = pd.concat(
+        {key: pd.DataFrame(value) for key, value in data.items()}, names=["factor"]
+    ).reset_index(level="factor")
+    long_df["日期"] = pd.to_datetime(long_df["date"])
+    return long_df[["日期", "factor", "return"]]
+
+
+def to_wide(long_df):
+    """长表一次性透视为宽表: 每行一个日期, 每列一个因子, 因子列保持接口返回的顺序"""
+    long_df = long_df.drop_duplicates(["日期", "factor"], keep="last")
+    all_data = long_df.pivot(index="日期", columns="factor", values="return")
+    all_data = all_data[long_df["factor"].unique()]
+    all_data.columns.name = None
+    return all_data.sort_index().reset_index(drop=False)
+
+
+def main(storage: str = "wide"):
+    """
+    :param storage: "wide" 写入每个因子一列的宽表(原有格式); "long" 写入长表 factor_returns;
+        "both" 同时写入两种格式
+    """
     # 连接数据库
     engine = connect_to_database()
     today = datetime.now().date()
     today = np.datetime_as_string(np.datetime64(today), unit="D")
-    url_dict = {
-        "cne5": "https://pyapi.huofuniu.com/pyapi/factor/price?mod=cne5_style&sd={}&ed={}",
-        "cne6": "https://pyapi.huofuniu.com/pyapi/factor/price?mod=cne6_style_new&sd={}&ed={}",
-        "future": "https://pyapi.huofuniu.com/pyapi/factor/price?mod=future_new&plate=&sd={}&ed={}",
-    }
 
     headers = {
         "access-token": HUOFUNIU_TOKEN,
     }
-    for type, url in url_dict.items():
-        latest_date = get_latest_date(engine, type)
+    # 三类因子的所有区间一起并发请求, 同时写两种格式时从较早的最新日期开始获取
+    jobs = []
+    wide_latest_dates = {}
+    for type, url in URL_DICT.items():
+        latest_dates = []
+        if storage in ("wide", "both"):
+            wide_latest_dates[type] = get_latest_date(engine, type)
+            latest_dates.append(wide_latest_dates[type])
+        if storage in ("long", "both"):
+            latest_long_date = get_latest_long_date(engine, type)
+            latest_dates.append(
+                pd.Timestamp(LONG_START_DATE) - pd.Timedelta(days=1)
+                if latest_long_date is None
+                else latest_long_date
+            )
         start_date = np.datetime_as_string(
-            np.datetime64(latest_date) + np.timedelta64(1, "D"), unit="D"
+            np.datetime64(min(latest_dates)) + np.timedelta64(1, "D"), unit="D"
         )
-        print(f"Fetching data from {url.format(start_date, today)}")
-        url = url.format(start_date, today)
-        data = requests.get(url, headers=headers).json()["data"]
-        all_data = pd.DataFrame()
-        if not data or len(data) == 0:
+        for chunk_start, chunk_end in date_chunks(start_date, today):
+            jobs.append((type, url, chunk_start, chunk_end))
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(fetch_factor_returns, url, chunk_start, chunk_end, headers)
+            for _, url, chunk_start, chunk_end in jobs
+        ]
+        results = [future.result() for future in futures]
+
+    for type in URL_DICT:
+        long_dfs = [
+            long_df
+            for (job_type, *_), long_df in zip(jobs, results)
+            if job_type == type and long_df is not None
+        ]
+        if not long_dfs:
             print(f"没有需要更新的{type}的数据")
             continue
-        for key, value in data.items():
-            value = pd.DataFrame(value)
-            value["日期"] = pd.to_datetime(value["date"])
-            value.set_index("日期", inplace=True)
-            value.rename(columns={"return": key}, inplace=True)
-            value.drop(columns=["date"], inplace=True)
-            all_data = pd.concat([all_data, value], axis=1)
-        all_data.reset_index(drop=False, inplace=True)
+        long_df = pd.concat(long_dfs, ignore_index=True)
+        if storage in ("long", "both"):
+            write_long(engine, type, long_df)
+            print(f"数据已成功写入{LONG_TABLE}表。")
+        if storage not in ("wide", "both"):
+            continue
+        all_data = to_wide(long_df)
+        # 同时写两种格式时可能多取了宽表已有的日期
+        all_data = all_data[all_data["日期"] > wide_latest_dates[type]]
         print(f"获取的{type}共有{len(all_data)}条数据")
         if all_data.empty:
             print(f"没有需要更新的{type}的数据")
-        else:
-            all_data.to_sql(
-                name=type,
-                con=engine,
-                if_exists="append",
-                index=False,
-                dtype={"日期": sqlalchemy.types.Date},
-            )
-            print(f"数据已成功写入{type}表。")
+            continue
+        all_data.to_sql(
+            name=type,
+            con=engine,
+            if_exists="append",
+            index=False,
+            dtype={"日期": sqlalchemy.types.Date},
+        )
+        print(f"数据已成功写入{type}表。")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--storage",
+        choices=["wide", "long", "both"],
+        default="wide",
+        help="wide: 每个因子一列的宽表; long: 长表 factor_returns; both: 同时写入",
+    )
+    args = parser.parse_args()
+    main(storage=args.storage)
@@ -19,4 +19,7 @@ SQL_PASSWORDS = os.getenv('SQL_PASSWORDS')
 SQL_HOST = os.getenv('SQL_HOST')
 HUOFUNIU_TOKEN = os.getenv('HUOFUNIU_TOKEN')
 APPID = os.getenv('APPID')
-APPKEY = os.getenv('APPKEY')
\ No newline at end of file
+APPKEY = os.getenv('APPKEY')
+# 可选: HTTP 响应缓存目录及大小上限(MB), 未设置目录时不启用缓存
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR')
+HTTP_CACHE_MAX_MB = int(os.getenv('HTTP_CACHE_MAX_MB', '512'))
\ No newline at end of file
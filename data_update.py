@@ -1,23 +1,58 @@
-from utils import load_bais
+from utils import load_bais, map_in_order, upsert_dataframe
+from trading_calendar import get_trading_calendar
+import numpy as np
+import pandas as pd
 import sqlalchemy
+from sqlalchemy import text
 import os
 
 SQL_PASSWORDS = os.environ["SQL_PASSWORDS"]
 SQL_HOST = os.environ["SQL_HOST"]
 
-def write_to_sql(data, table_name, engine):
-    data.to_sql(
-        name=table_name,
-        con=engine,
-        if_exists="replace",
-        index=False,
-        dtype={
-            "日期": sqlalchemy.types.Date,
-            "主力合约": sqlalchemy.types.String(20),
-            "到期日": sqlalchemy.types.Date,
-            "剩余天数": sqlalchemy.types.Integer,
-        },
-    )
+FUTURE_TYPES = ["IF", "IC", "IM", "IH"]
+# 天软单次最多返回的交易日数
+MAX_DAYS = 251
+BASIS_DTYPE = {
+    "日期": sqlalchemy.types.Date,
+    "主力合约": sqlalchemy.types.String(20),
+    "到期日": sqlalchemy.types.Date,
+    "剩余天数": sqlalchemy.types.Integer,
+}
+
+
+def get_latest_date(engine, table_name):
+    """读取表中最新的日期, 表不存在或为空时返回 None"""
+    try:
+        with engine.connect() as connection:
+            latest_date = connection.execute(
+                text(f"SELECT MAX(`日期`) FROM `{table_name}`")
+            ).scalar()
+    except Exception as e:
+        print(f"读取 {table_name} 最新日期失败, 将全量获取: {e}")
+        return None
+    return None if latest_date is None else np.datetime64(latest_date, "D")
+
+
+def days_to_fetch(latest_date):
+    """需要向天软请求的交易日数: 从 latest_date 之后到今天的交易日数, 多取几天冗余"""
+    if latest_date is None:
+        return MAX_DAYS
+    today = np.datetime64("today", "D")
+    gap = len(get_trading_calendar().trading_days_between(latest_date, today))
+    return min(MAX_DAYS, gap + 5)
+
+
+def write_to_sql(data, table_name, engine, latest_date):
+    """只写入比 latest_date 更新的交易日, 按日期合并写入"""
+    data = data.copy()
+    data["日期"] = pd.to_datetime(data["日期"]).dt.date
+    data["到期日"] = pd.to_datetime(data["到期日"]).dt.date
+    if latest_date is not None:
+        data = data[data["日期"] > latest_date.astype(object)]
+    if data.empty:
+        print(f"{table_name} 已是最新, 无需更新.")
+        return
+    upsert_dataframe(engine, data, table_name, ["日期"], dtype=BASIS_DTYPE)
 
 
 if __name__ == "__main__":
@@ -25,7 +60,18 @@ if __name__ == "__main__":
         f"mysql+pymysql://dev:{SQL_PASSWORDS}@{SQL_HOST}:3306/UpdatedData?charset=utf8"
     )
     print("Updating IF/IC/IM data...")
-    for future_type in ["IF", "IC", "IM", "IH"]:
-        data = load_bais(future_type)
-        write_to_sql(data, f"{future_type}_data", engine)
+    latest_dates = {
+        future_type: get_latest_date(engine, f"{future_type}_data")
+        for future_type in FUTURE_TYPES
+    }
+    # 四个合约并发请求, 共用同一个连接池
+    results = map_in_order(
+        lambda future_type: load_bais(
+            future_type, n=days_to_fetch(latest_dates[future_type])
+        ),
+        FUTURE_TYPES,
+        max_workers=len(FUTURE_TYPES),
+    )
+    for future_type, data in zip(FUTURE_TYPES, results):
+        write_to_sql(data, f"{future_type}_data", engine, latest_dates[future_type])
         print(f"{future_type} data updated successfully.")
@@ -1,14 +1,21 @@
+import argparse
+import itertools
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from utils import (
     connect_to_database,
-    load_holidays,
-    get_latest_dates,
-    update_latest_dates,
+    rebuild_watermarks,
     get_source_info,
-    fetch_akshare_data,
-    save_data_to_database,
+    iter_akshare_data,
+    fetch_akshare_snapshot,
+    stream_to_database,
+    SymbolCheckpointWriter,
 )
+from trading_calendar import get_trading_calendar
+
+# akshare 并发线程数, 实际并发还受 utils.SOURCE_CONCURRENCY["ak"] 限制
+AK_MAX_WORKERS = 8
 
 # --- 函数定义 ---
 # 删除原有的 update_latest_dates、get_source_info、fetch_akshare_data 和 save_data_to_database 函数
@@ -17,22 +24,36 @@ from utils import (
 # ==============================================================================
 #                               主程序入口
 # ==============================================================================
-def main():
-    """程序的主执行函数"""
-    # 判断交易日，决定是否运行
-    holiday_path = "Chinese_special_holiday.txt"
-    holidays = load_holidays(holiday_path)
-
+def main(rebuild: bool = False, checkpoint: bool = False, snapshot: bool = True):
+    """
+    程序的主执行函数
+    :param rebuild: 是否先全表扫描重建 info 表中的最新日期
+    :param checkpoint: 是否逐个代码提交数据和最新日期; 中断后重跑时, 已更新到最近交易日的代码会被跳过
+    :param snapshot: 是否对只缺最近一个交易日的代码使用全市场截面模式, 其余代码仍逐个获取
+    """
     # 定义表名
     table_name = "stock_basic_data_ak"
     info_name = "stock_info_ak"
 
     # 执行数据处理流程
     engine = connect_to_database()
-    latest_dates_df = get_latest_dates(engine, table_name)
-    update_latest_dates(engine, latest_dates_df, info_name)
+    # info 表中的 updated_date 即为各代码的水位线, 每次运行按写入的数据增量维护
+    if rebuild:
+        rebuild_watermarks(engine, table_name, info_name)
     info_df = get_source_info(engine, info_name)
     info_df["updated_date"] = pd.to_datetime(info_df["updated_date"])
+    on_data = None
+    if checkpoint:
+        # 已更新到最近一个交易日的代码在上次运行中已提交, 无需重新获取
+        target_date = pd.Timestamp(
+            get_trading_calendar().prev_trading_day(
+                np.datetime64("today"), include_self=True
+            )
+        )
+        done = info_df["updated_date"] >= target_date
+        print(f"检查点模式: 跳过已更新到 {target_date.date()} 的 {done.sum()} 个代码")
+        info_df = info_df[~done]
+        on_data = SymbolCheckpointWriter(engine, table_name, info_name)
 
     # 创建查询表
     symbols_ak = {
@@ -44,22 +65,62 @@ def main():
     print("获取到的指数代码信息：")
     print("akshare:", symbols_ak)
 
-    # 初始化数据列表和日期
-    all_new_data = []
+    # 初始化日期
     today_str = datetime.now().strftime("%Y%m%d")
     latest_dates_dict = info_df.set_index("code")["updated_date"].to_dict()
 
-    # 从各数据源获取数据
-    all_new_data.extend(fetch_akshare_data(symbols_ak, latest_dates_dict, today_str))
-    all_new_data = [df for df in all_new_data if not df.empty]
+    # 只缺最近一个交易日的代码从全市场快照中获取, 其余代码逐个获取, 不在内存中累积全部数据
+    snapshot_data = []
+    if snapshot:
+        snapshot_data, symbols_ak = fetch_akshare_snapshot(
+            symbols_ak, latest_dates_dict, engine, table_name, on_data=on_data
+        )
+    frames = itertools.chain(
+        snapshot_data,
+        iter_akshare_data(
+            symbols_ak,
+            latest_dates_dict,
+            today_str,
+            max_workers=AK_MAX_WORKERS,
+            on_data=on_data,
+        ),
+    )
+    if checkpoint:
+        # 数据和最新日期已在获取时逐个代码提交, 这里只需驱动获取过程
+        for _ in frames:
+            pass
+        print(
+            f"检查点模式完成: 成功 {len(on_data.completed)} 个代码, "
+            f"失败 {len(on_data.failed)} 个代码: {on_data.failed}"
+        )
+        return
 
-    # 保存数据到数据库
-    save_data_to_database(all_new_data, table_name, engine, holidays)
-    # 最后再更新一遍最新日期，确保bench_info_wind表中的日期是最新的
-    latest_dates_df = get_latest_dates(engine, table_name)
-    update_latest_dates(engine, latest_dates_df, info_name)
+    # 分批写入数据库, 按 (code, date) 合并写入, 重复运行不会产生重复数据;
+    # 每批写入后只根据写入的数据推进最新日期, 无需全表扫描
+    stream_to_database(frames, table_name, engine, info_name=info_name)
 
 
 # 当该脚本被直接执行时，调用main()函数
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rebuild-watermarks",
+        action="store_true",
+        help="先全表扫描数据表, 重建 info 表中每个代码的最新日期",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        help="逐个代码提交数据和最新日期, 中断后重跑可从断点继续",
+    )
+    parser.add_argument(
+        "--no-snapshot",
+        action="store_true",
+        help="不使用全市场截面模式, 所有代码逐个获取",
+    )
+    args = parser.parse_args()
+    main(
+        rebuild=args.rebuild_watermarks,
+        checkpoint=args.checkpoint,
+        snapshot=not args.no_snapshot,
+    )
@@ -1,17 +1,33 @@
+import argparse
 import tushare as ts
-from utils import connect_to_database
+from utils import connect_to_database, map_in_order, upsert_dataframe, TokenBucket
 import pandas as pd
 from datetime import datetime, timedelta
-import time
+from sqlalchemy import text
+from sqlalchemy.types import Date, String
+from index_cons_delta import write_snapshots
 
 # 由于tushare一次只能申请6000行数据，所以要分段获取
 # 这里的token是临时token，只能使用到9/17日，遂不加密了
 
 pro = ts.pro_api("59a28246427fde8f16d3b7e83b51d63bc9708ff2972d91777617c560")
-engine = connect_to_database()
 
 symbols = ["000300.SH", "000985.SH", "000852.SH", "000905.SH"]
 
+# 表为空时从该日期开始获取
+START_DATE = "20210101"
+# tushare 每分钟允许的调用次数, 所有线程共享
+CALLS_PER_MINUTE = 200
+MAX_WORKERS = 4
+KEY_COLUMNS = ["trade_date", "con_code"]
+CONS_DTYPE = {"trade_date": Date, "con_code": String(16), "index_code": String(16)}
+# 本脚本自己的同步进度: 每个指数已从 tushare 获取到的最新交易日。
+# 成分股表还由 index_cons_update 每日写入, 不能用表中的最新日期判断 tushare 的进度
+SYNC_TABLE = "index_cons_tushare_sync"
+SYNC_DTYPE = {"index_code": String(16), "latest_date": Date}
+
+rate_limiter = TokenBucket(CALLS_PER_MINUTE / 60, capacity=MAX_WORKERS)
+
 
 # 定义时间分段函数
 def get_date_ranges(start_date, end_date, max_days_per_request=20):
@@ -22,7 +38,7 @@ def get_date_ranges(start_date, end_date, max_days_per_request=20):
     date_ranges = []
     current_start = start
 
-    while current_start < end:
+    while current_start <= end:
         current_end = min(current_start + timedelta(days=max_days_per_request), end)
         date_ranges.append(
             (current_start.strftime("%Y%m%d"), current_end.strftime("%Y%m%d"))
@@ -32,67 +48,131 @@ def get_date_ranges(start_date, end_date, max_days_per_request=20):
     return date_ranges
 
 
-# 主循环
-for symbol in symbols:
-    print(f"正在处理指数: {symbol}")
-
-    # 定义表名
-    table_name = f"index_{symbol.replace('.SH', '')}_cons"
-
-    # 获取时间分段
-    date_ranges = get_date_ranges("20210101", "20250915")
-
-    all_data = pd.DataFrame()
-
-    for start_date, end_date in date_ranges:
-        print(f"请求 {start_date} 到 {end_date} 的数据...")
-
-        try:
-            # 获取分段数据
-            chunk_data = pro.index_weight(
-                index_code=symbol, start_date=start_date, end_date=end_date
+def get_latest_trade_date(engine, symbol):
+    """该指数已从 tushare 同步到的最新交易日, 同步表不存在或没有该指数时返回 None"""
+    try:
+        with engine.connect() as connection:
+            latest_date = connection.execute(
+                text(f"SELECT `latest_date` FROM `{SYNC_TABLE}` WHERE `index_code` = :symbol"),
+                {"symbol": symbol},
+            ).scalar()
+    except Exception as e:
+        print(f"读取 {SYNC_TABLE} 中 {symbol} 的同步进度失败, 将从 {START_DATE} 开始获取: {e}")
+        return None
+    return None if latest_date is None else pd.Timestamp(latest_date)
+
+
+def update_latest_trade_date(engine, symbol, latest_date):
+    """所有数据写入成功后记录该指数的同步进度"""
+    upsert_dataframe(
+        engine,
+        pd.DataFrame({"index_code": [symbol], "latest_date": [latest_date]}),
+        SYNC_TABLE,
+        ["index_code"],
+        dtype=SYNC_DTYPE,
+    )
+
+
+def fetch_window(symbol, start_date, end_date):
+    """
+    获取一个时间段的成分股权重, 调用前先从令牌桶取得配额
+    :return: (是否成功, 数据), 没有数据时数据为 None
+    """
+    print(f"请求 {symbol} {start_date} 到 {end_date} 的数据...")
+    try:
+        rate_limiter.acquire()
+        chunk_data = pro.index_weight(
+            index_code=symbol, start_date=start_date, end_date=end_date
+        )
+    except Exception as e:
+        print(f"获取 {symbol} {start_date} 到 {end_date} 的数据时出错: {e}")
+        return False, None
+    if chunk_data.empty:
+        return True, None
+    chunk_data['con_code'] = chunk_data['con_code'].str.split('.').str[0]  # 去掉后缀
+    chunk_data['index_code'] = chunk_data['index_code'].str.split('.').str[0]
+    return True, chunk_data
+
+
+def main(start_date=None, end_date=None, storage: str = "full"):
+    """
+    同步各指数的成分股权重, 只按 (trade_date, con_code) 合并写入新获取的数据
+    :param start_date: 开始日期 YYYYMMDD, 为 None 时从 SYNC_TABLE 中该指数已同步的最新交易日的下一天开始
+        (没有同步记录时从 START_DATE 开始)
+    :param end_date: 结束日期 YYYYMMDD, 默认为今天
+    :param storage: 同 index_cons_update.main; 紧凑存储只能按日期顺序追加, 早于其最新日期
+        (包括 index_cons_update 每日写入的日期)的快照会被跳过, 不能用于补写历史
+    """
+    engine = connect_to_database()
+    end_date = end_date or datetime.now().strftime("%Y%m%d")
+
+    # 所有指数的所有时间段一起并发请求, 总调用频率由令牌桶控制
+    jobs = []
+    for symbol in symbols:
+        table_name = f"index_{symbol.replace('.SH', '')}_cons"
+        symbol_start = start_date
+        if symbol_start is None:
+            latest_date = get_latest_trade_date(engine, symbol)
+            symbol_start = (
+                START_DATE
+                if latest_date is None
+                else (latest_date + timedelta(days=1)).strftime("%Y%m%d")
             )
-
-            if not chunk_data.empty:
-                chunk_data['con_code'] = chunk_data['con_code'].str.split('.').str[0]  # 去掉后缀
-                chunk_data['index_code'] = chunk_data['index_code'].str.split('.').str[0]
-                all_data = pd.concat([all_data, chunk_data], ignore_index=True)
-
-            # 添加延迟以避免频繁请求
-            time.sleep(0.5)
-
-        except Exception as e:
-            print(f"获取 {start_date} 到 {end_date} 的数据时出错: {e}")
+        date_ranges = get_date_ranges(symbol_start, end_date)
+        print(f"指数 {symbol}: 从 {symbol_start} 开始, 共 {len(date_ranges)} 个时间段")
+        jobs.extend((symbol, window_start, window_end) for window_start, window_end in date_ranges)
+    results = map_in_order(
+        lambda job: fetch_window(*job), jobs, max_workers=MAX_WORKERS
+    )
+    chunks = {symbol: [] for symbol in symbols}
+    failed = {symbol: [] for symbol in symbols}
+    for (symbol, window_start, window_end), (ok, chunk_data) in zip(jobs, results):
+        if not ok:
+            failed[symbol].append((window_start, window_end))
+        elif chunk_data is not None:
+            chunks[symbol].append(chunk_data)
+
+    for symbol in symbols:
+        table_name = f"index_{symbol.replace('.SH', '')}_cons"
+        # 下次运行从已同步的最新交易日之后开始, 有时间段失败时写入其后的数据会留下永久缺口, 整个指数本次不写入
+        if failed[symbol]:
+            print(f"{symbol} 有 {len(failed[symbol])} 个时间段获取失败, 本次不写入, 请重新运行: {failed[symbol]}")
             continue
-
-    # 去重处理
-    if not all_data.empty:
-        # 检查表是否已存在
-        try:
-            existing_data = pd.read_sql_table(table_name, engine)
-            # 合并新旧数据并去重
-            combined_data = pd.concat([existing_data, all_data], ignore_index=True)
-            combined_data = combined_data.drop_duplicates(
-                subset=["trade_date", "con_code"], keep="last"
-            ).reset_index(drop=True)
-        except:
-            # 表不存在，直接使用新数据
-            combined_data = all_data.drop_duplicates(
-                subset=["trade_date", "con_code"], keep="last"
-            ).reset_index(drop=True)
-
-        # 写入数据库
-        combined_data["trade_date"] = pd.to_datetime(combined_data["trade_date"]).dt.date
-        combined_data.to_sql(table_name, engine, if_exists="replace", index=False)
+        if not chunks[symbol]:
+            print(f"{symbol} 没有新的数据")
+            continue
+        new_data = pd.concat(chunks[symbol], ignore_index=True)
+        new_data["trade_date"] = pd.to_datetime(new_data["trade_date"]).dt.date
+        if storage in ("full", "both"):
+            upsert_dataframe(
+                engine, new_data, table_name, KEY_COLUMNS, dtype=CONS_DTYPE
+            )
+        if storage in ("delta", "both"):
+            write_snapshots(engine, table_name, new_data)
+        new_trade_dates = new_data["trade_date"].unique()
+        # 指定较早的 start_date 补数时同步进度只往后推
+        latest_date = get_latest_trade_date(engine, symbol)
+        if latest_date is None or max(new_trade_dates) > latest_date.date():
+            update_latest_trade_date(engine, symbol, max(new_trade_dates))
 
         # 打印统计信息
-        combined_trade_dates = combined_data["trade_date"].unique()
-        print(f"表 {table_name} 已更新，包含 {len(combined_trade_dates)} 个交易日的数据")
-        print(f"最新交易日: {max(combined_trade_dates)}")
-        print(f"总记录数: {len(combined_data)}")
-    else:
-        print(f"未能获取 {symbol} 的任何数据")
-
-# 关闭连接
-engine.dispose()
-print("所有指数数据更新完成")
+        print(f"表 {table_name} 已更新 {len(new_trade_dates)} 个交易日的数据")
+        print(f"最新交易日: {max(new_trade_dates)}")
+
+    # 关闭连接
+    engine.dispose()
+    print("所有指数数据更新完成")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start", help="开始日期 YYYYMMDD, 默认从已同步的最新交易日之后开始")
+    parser.add_argument("--end", help="结束日期 YYYYMMDD, 默认为今天")
+    parser.add_argument(
+        "--storage",
+        choices=["full", "delta", "both"],
+        default="full",
+        help="full: 完整快照表; delta: 只存成分和权重变化的紧凑存储; both: 同时写入",
+    )
+    args = parser.parse_args()
+    main(start_date=args.start, end_date=args.end, storage=args.storage)
@@ -0,0 +1,208 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+import requests
+
+# 签名、时间戳、随机数等每次请求都会变化的参数, 不参与缓存键的计算
+VOLATILE_PARAMS = {"sign", "timestamp", "g_randomid", "_"}
+# 各数据源主机的缓存有效期(秒), 未列出的主机使用 DEFAULT_TTL
+SOURCE_TTLS = {
+    "indexapi.wind.com.cn": 6 * 3600,
+    "www.csindex.com.cn": 6 * 3600,
+    "hq.cnindex.com.cn": 6 * 3600,
+    "gs.amac.org.cn": 12 * 3600,
+    "web.tinysoft.com.cn": 6 * 3600,
+    "pyapi.huofuniu.com": 6 * 3600,
+    "mallapi.huofuniu.com": 6 * 3600,
+}
+DEFAULT_TTL = 3600
+
+
+def _normalize_pairs(pairs) -> list:
+    """去掉易变参数并排序, 使参数顺序和签名不影响缓存键"""
+    return sorted(
+        (str(key), str(value)) for key, value in pairs if key not in VOLATILE_PARAMS
+    )
+
+
+def _normalize_json(value):
+    if isinstance(value, dict):
+        return {
+            key: _normalize_json(item)
+            for key, item in value.items()
+            if key not in VOLATILE_PARAMS
+        }
+    if isinstance(value, list):
+        return [_normalize_json(item) for item in value]
+    return value
+
+
+def make_cache_key(method, url, params=None, data=None, json_body=None) -> str:
+    """由请求方法、URL 和归一化后的参数/请求体计算缓存键"""
+    parsed = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+    if isinstance(params, dict):
+        query.extend(params.items())
+    elif params:
+        query.extend(params)
+    if isinstance(data, (str, bytes)):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "ignore")
+        body = _normalize_pairs(urllib.parse.parse_qsl(data, keep_blank_values=True))
+    elif isinstance(data, dict):
+        body = _normalize_pairs(data.items())
+    else:
+        body = None
+    payload = {
+        "method": method.upper(),
+        "url": f"{parsed.scheme}://{parsed.netloc}{parsed.path}",
+        "query": _normalize_pairs(query),
+        "data": body,
+        "json": _normalize_json(json_body),
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+class ResponseCache:
+    """
+    基于磁盘的 HTTP 响应缓存
+    响应体 gzip 压缩后按缓存键存放, 按主机设置有效期;
+    总大小超过 max_bytes 时按最近访问时间淘汰(LRU, 命中时刷新文件的修改时间)
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = 512 * 1024 * 1024, ttls=None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttls = SOURCE_TTLS if ttls is None else ttls
+        self._lock = threading.Lock()
+        self._total_bytes = sum(
+            path.stat().st_size for path in self.cache_dir.glob("*/*.gz")
+        )
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(key[:2], f"{key}.gz")
+
+    def get(self, key: str, host: str):
+        """返回 (status_code, headers, body), 不存在或已过期时返回 None"""
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if time.time() - meta["created"] > self.ttls.get(host, DEFAULT_TTL):
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)  # 刷新最近访问时间
+        return meta["status_code"], meta["headers"], body
+
+    def set(self, key: str, status_code: int, headers: dict, body: bytes):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        meta = {"created": time.time(), "status_code": status_code, "headers": headers}
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(json.dumps(meta).encode("utf-8") + b"\n")
+            f.write(body)
+        with self._lock:
+            self._total_bytes += tmp_path.stat().st_size
+            if path.exists():
+                self._total_bytes -= path.stat().st_size
+            os.replace(tmp_path, path)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """淘汰最久未访问的缓存, 直到总大小降到 max_bytes 的 90% 以下"""
+        files = sorted(
+            (stat.st_mtime, stat.st_size, path)
+            for path in self.cache_dir.glob("*/*.gz")
+            for stat in [path.stat()]
+        )
+        self._total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            self._total_bytes -= size
+
+
+# 表示"暂无数据"的空值, 数据可能稍后才发布, 不应缓存
+_EMPTY_VALUES = (None, [], {}, "")
+
+
+def is_cacheable(response: requests.Response) -> bool:
+    """
+    响应是否可以缓存: 状态码为 200, 且 JSON 响应体中没有非零的 error_code,
+    data / Result 字段(若存在)不为空; 非 JSON 响应只看状态码
+    """
+    if response.status_code != 200:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    if not isinstance(body, dict):
+        return True
+    if body.get("error_code", 0) not in (0, "0"):
+        return False
+    return not any(body.get(key, True) in _EMPTY_VALUES for key in ("data", "Result"))
+
+
+class CachedSession(requests.Session):
+    """
+    requests.Session 的子类
+    未指定 timeout 时使用默认超时; 设置了 cache 时, 通过 is_cacheable 检查的响应会写入缓存, 命中时不再发起请求。
+    单次请求传入 cache=False 时跳过读取缓存(如失败后重试), 新的响应仍按 is_cacheable 写入缓存
+    """
+
+    def __init__(self, cache: ResponseCache = None, timeout=None):
+        super().__init__()
+        self.cache = cache
+        self.timeout = timeout
+
+    def request(
+        self, method, url, params=None, data=None, json=None, cache=True, **kwargs
+    ):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        if self.cache is None:
+            return super().request(
+                method, url, params=params, data=data, json=json, **kwargs
+            )
+        host = urllib.parse.urlsplit(url).netloc
+        key = make_cache_key(method, url, params, data, json)
+        cached = self.cache.get(key, host) if cache else None
+        if cached is not None:
+            status_code, headers, body = cached
+            response = requests.Response()
+            response.status_code = status_code
+            response.headers.update(headers)
+            response._content = body
+            response.url = url
+            response.encoding = requests.utils.get_encoding_from_headers(
+                response.headers
+            )
+            return response
+        response = super().request(
+            method, url, params=params, data=data, json=json, **kwargs
+        )
+        if is_cacheable(response):
+            # 缓存的是解压后的响应体, 去掉与原始传输相关的头
+            headers = {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in ("content-encoding", "content-length")
+            }
+            self.cache.set(key, response.status_code, headers, response.content)
+        return response
@@ -0,0 +1,279 @@
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.types import Date, Float, String
+from utils import merge_into_table, prepare_upsert_table, upsert_dataframe
+
+# 成分股表 index_xxx_cons 的紧凑存储, 由三张表组成:
+#   {table}_dates:   每个快照日期一行 (trade_date, index_code, members)
+#   {table}_members: 成分股的有效区间 (con_code, valid_from, valid_to), valid_to 为最后一个仍在成分中的快照日期,
+#                    仍在成分中时为 NULL
+#   {table}_weights: 只在成分股进入指数或权重变化的日期记录 (con_code, trade_date, weight)
+# 某日的快照 = 该日有效的成分股 + 各成分股在该日或之前最近一次记录的权重
+COLUMNS = ["index_code", "con_code", "trade_date", "weight"]
+DATES_KEY = ["trade_date"]
+MEMBERS_KEY = ["con_code", "valid_from"]
+WEIGHTS_KEY = ["con_code", "trade_date"]
+DELTA_DTYPE = {
+    "trade_date": Date,
+    "valid_from": Date,
+    "valid_to": Date,
+    "index_code": String(16),
+    "con_code": String(16),
+    "weight": Float(53),
+}
+
+
+def delta_tables(table_name):
+    """紧凑存储使用的三张表名"""
+    return f"{table_name}_dates", f"{table_name}_members", f"{table_name}_weights"
+
+
+def _weight_changed(weight, prev_weight):
+    return ~((weight == prev_weight) | (weight.isna() & prev_weight.isna()))
+
+
+def encode(full: pd.DataFrame):
+    """
+    将完整的逐日快照表编码为紧凑形式
+    :param full: 列为 COLUMNS 的完整成分股表, 可包含多个日期
+    :return: (dates, members, weights) 三个 DataFrame
+    """
+    full = full[COLUMNS].drop_duplicates(["trade_date", "con_code"], keep="last")
+    dates = (
+        full.groupby("trade_date", sort=True)
+        .agg(index_code=("index_code", "first"), members=("con_code", "size"))
+        .reset_index()
+    )
+    position = pd.Series(range(len(dates)), index=dates["trade_date"])
+    full = full.assign(pos=full["trade_date"].map(position).values).sort_values(
+        ["con_code", "pos"]
+    )
+    # 同一代码在相邻的快照中都出现时属于同一个有效区间
+    new_run = (full["con_code"] != full["con_code"].shift()) | (
+        full["pos"] != full["pos"].shift() + 1
+    )
+    members = (
+        full.groupby(new_run.cumsum())
+        .agg(
+            con_code=("con_code", "first"),
+            valid_from=("trade_date", "first"),
+            valid_to=("trade_date", "last"),
+        )
+        .reset_index(drop=True)
+    )
+    members["valid_to"] = members["valid_to"].astype(object)
+    members.loc[members["valid_to"] == dates["trade_date"].iloc[-1], "valid_to"] = None
+    changed = new_run | _weight_changed(full["weight"], full["weight"].shift())
+    weights = full.loc[changed, ["con_code", "trade_date", "weight"]].reset_index(
+        drop=True
+    )
+    return dates, members, weights
+
+
+def diff_snapshot(open_members: pd.DataFrame, last_date, snapshot: pd.DataFrame):
+    """
+    计算在已有紧凑存储之后追加一个快照需要写入的行
+    :param open_members: 当前仍在成分中的代码及其最近一次记录的权重, 列为 con_code, valid_from, weight
+    :param last_date: 已存储的最新快照日期, 没有时为 None
+    :param snapshot: 新快照, 列为 COLUMNS, 日期必须晚于 last_date
+    :return: (dates, members, weights) 需要合并写入的行, members 中包含新区间和被关闭的区间
+    """
+    trade_date = snapshot["trade_date"].iloc[0]
+    if last_date is not None and trade_date <= last_date:
+        raise ValueError(f"快照日期 {trade_date} 不晚于已存储的最新日期 {last_date}")
+    snapshot = snapshot[COLUMNS].drop_duplicates("con_code", keep="last")
+    dates = pd.DataFrame(
+        {
+            "trade_date": [trade_date],
+            "index_code": [snapshot["index_code"].iloc[0]],
+            "members": [len(snapshot)],
+        }
+    )
+    merged = snapshot.merge(
+        open_members,
+        on="con_code",
+        how="outer",
+        suffixes=("", "_prev"),
+        indicator=True,
+    )
+    entered = merged[merged["_merge"] == "left_only"]
+    left = merged[merged["_merge"] == "right_only"]
+    kept = merged[merged["_merge"] == "both"]
+    members = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "con_code": entered["con_code"],
+                    "valid_from": trade_date,
+                    "valid_to": None,
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "con_code": left["con_code"],
+                    "valid_from": left["valid_from"],
+                    "valid_to": last_date,
+                }
+            ),
+        ],
+        ignore_index=True,
+    )
+    changed = pd.concat(
+        [entered, kept[_weight_changed(kept["weight"], kept["weight_prev"])]]
+    )
+    weights = pd.DataFrame(
+        {
+            "con_code": changed["con_code"],
+            "trade_date": trade_date,
+            "weight": changed["weight"],
+        }
+    ).reset_index(drop=True)
+    return dates, members, weights
+
+
+def reconstruct(dates, members, weights, trade_date) -> pd.DataFrame:
+    """由紧凑形式还原某个日期的快照, 与完整表中该日期的数据一致(按 con_code 排序), 非快照日期返回空表"""
+    date_row = dates[dates["trade_date"] == trade_date]
+    if date_row.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    valid = members[
+        (members["valid_from"] <= trade_date)
+        & (members["valid_to"].isna() | (members["valid_to"] >= trade_date))
+    ]
+    latest = (
+        weights[weights["trade_date"] <= trade_date]
+        .sort_values("trade_date")
+        .drop_duplicates("con_code", keep="last")
+    )
+    snapshot = valid[["con_code"]].merge(latest[["con_code", "weight"]], on="con_code")
+    snapshot.insert(0, "index_code", date_row["index_code"].iloc[0])
+    snapshot.insert(2, "trade_date", trade_date)
+    return snapshot.sort_values("con_code").reset_index(drop=True)
+
+
+def _load_state(engine, table_name):
+    """读取已存储的最新快照日期和仍在成分中的代码及其最近权重, 表不存在时返回 (None, 空表)"""
+    dates_table, members_table, weights_table = delta_tables(table_name)
+    empty = pd.DataFrame(columns=["con_code", "valid_from", "weight"])
+    try:
+        with engine.connect() as connection:
+            last_date = connection.execute(
+                text(f"SELECT MAX(`trade_date`) FROM `{dates_table}`")
+            ).scalar()
+            if last_date is None:
+                return None, empty
+            open_members = pd.read_sql_query(
+                text(
+                    f"SELECT m.`con_code`, m.`valid_from`, w.`weight` FROM `{members_table}` AS m "
+                    f"JOIN `{weights_table}` AS w ON w.`con_code` = m.`con_code` "
+                    f"AND w.`trade_date` = (SELECT MAX(`trade_date`) FROM `{weights_table}` "
+                    f"WHERE `con_code` = m.`con_code`) "
+                    f"WHERE m.`valid_to` IS NULL"
+                ),
+                connection,
+            )
+    except Exception as e:
+        print(f"读取 {table_name} 的紧凑存储失败, 视为空表: {e}")
+        return None, empty
+    return last_date, open_members
+
+
+def write_snapshot(engine, table_name, snapshot: pd.DataFrame):
+    """
+    追加一个日期的快照到紧凑存储, 只写入成分变化和权重变化的行, 三张表在同一个事务中提交;
+    日期不晚于已存储的最新日期时跳过并提示。紧凑存储只能按日期顺序追加, 补写更早的日期需要
+    完整表并用 rebuild_delta_tables 重建, 只使用紧凑存储时无法补写历史
+    :return: 写入的 (dates, members, weights) 行数, 跳过时返回 None
+    """
+    dates_table, members_table, weights_table = delta_tables(table_name)
+    last_date, open_members = _load_state(engine, table_name)
+    trade_date = snapshot["trade_date"].iloc[0]
+    if last_date is not None and trade_date == last_date:
+        print(f"{table_name}: {trade_date} 的快照已存储, 跳过。")
+        return None
+    if last_date is not None and trade_date < last_date:
+        print(
+            f"警告: {table_name} 的快照日期 {trade_date} 早于紧凑存储的最新日期 {last_date}, "
+            f"无法追加, 跳过; 补写历史需用完整表执行 rebuild_delta_tables。"
+        )
+        return None
+    dates, members, weights = diff_snapshot(open_members, last_date, snapshot)
+    rows = [
+        (dates_table, dates, DATES_KEY),
+        (members_table, members, MEMBERS_KEY),
+        (weights_table, weights, WEIGHTS_KEY),
+    ]
+    for name, data, key_columns in rows:
+        prepare_upsert_table(engine, data, name, key_columns, dtype=DELTA_DTYPE)
+    with engine.begin() as connection:
+        for name, data, key_columns in rows:
+            if not data.empty:
+                merge_into_table(connection, data, name, key_columns)
+    print(
+        f"{table_name}: {trade_date} 共 {len(snapshot)} 个成分股, "
+        f"写入 {len(members)} 条区间变化, {len(weights)} 条权重变化"
+    )
+    return len(dates), len(members), len(weights)
+
+
+def write_snapshots(engine, table_name, data: pd.DataFrame):
+    """按日期顺序逐个追加 data 中的快照, 不晚于已存储最新日期的快照跳过并提示"""
+    last_date, _ = _load_state(engine, table_name)
+    if last_date is not None:
+        stale = data["trade_date"] <= last_date
+        if stale.any():
+            print(
+                f"警告: {table_name} 有 {data.loc[stale, 'trade_date'].nunique()} 个日期不晚于紧凑存储的最新日期 "
+                f"{last_date}, 跳过; 补写历史需用完整表执行 rebuild_delta_tables。"
+            )
+        data = data[~stale]
+    for _, snapshot in data.sort_values("trade_date").groupby("trade_date"):
+        write_snapshot(engine, table_name, snapshot)
+
+
+def rebuild_delta_tables(engine, table_name):
+    """读取完整的成分股表, 重新编码并覆盖紧凑存储, 用于首次启用或补写了更早的日期之后"""
+    print(f"--- 由 {table_name} 重建紧凑存储 ---")
+    full = pd.read_sql_query(
+        text(f"SELECT {', '.join(f'`{c}`' for c in COLUMNS)} FROM `{table_name}`"),
+        engine,
+    )
+    full["trade_date"] = pd.to_datetime(full["trade_date"]).dt.date
+    encoded = dict(zip(delta_tables(table_name), encode(full)))
+    with engine.begin() as connection:
+        for name in encoded:
+            connection.execute(text(f"DROP TABLE IF EXISTS `{name}`"))
+    keys = dict(zip(delta_tables(table_name), [DATES_KEY, MEMBERS_KEY, WEIGHTS_KEY]))
+    for name, data in encoded.items():
+        upsert_dataframe(engine, data, name, keys[name], dtype=DELTA_DTYPE)
+    print(
+        f"{len(full)} 行完整快照编码为 "
+        + ", ".join(f"{name} {len(data)} 行" for name, data in encoded.items())
+    )
+
+
+def read_snapshot(engine, table_name, trade_date) -> pd.DataFrame:
+    """从紧凑存储还原某个日期的快照, 结果与 reconstruct 相同"""
+    dates_table, members_table, weights_table = delta_tables(table_name)
+    trade_date = pd.Timestamp(trade_date).date()
+    with engine.connect() as connection:
+        index_code = connection.execute(
+            text(f"SELECT `index_code` FROM `{dates_table}` WHERE `trade_date` = :date"),
+            {"date": trade_date},
+        ).scalar()
+        if index_code is None:
+            return pd.DataFrame(columns=COLUMNS)
+        snapshot = pd.read_sql_query(
+            text(
+                f"SELECT m.`con_code`, w.`weight` FROM `{members_table}` AS m "
+                f"JOIN `{weights_table}` AS w ON w.`con_code` = m.`con_code` "
+                f"AND w.`trade_date` = (SELECT MAX(`trade_date`) FROM `{weights_table}` "
+                f"WHERE `con_code` = m.`con_code` AND `trade_date` <= :date) "
+                f"WHERE m.`valid_from` <= :date AND (m.`valid_to` IS NULL OR m.`valid_to` >= :date)"
+            ),
+            connection,
+            params={"date": trade_date},
+        )
+    snapshot.insert(0, "index_code", index_code)
+    snapshot.insert(2, "trade_date", trade_date)
+    return snapshot.sort_values("con_code").reset_index(drop=True)
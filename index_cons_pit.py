@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from index_cons_delta import COLUMNS, delta_tables, encode
+
+
+class ConstituentIndex:
+    """
+    指数成分股的内存时点(point-in-time)索引
+    一次性加载成分股表, 构建 日期 x 成分股 的成分标记和权重矩阵, 以及每个成分股的有效区间;
+    之后按日期查询成分和权重均为内存中的 searchsorted, 不再访问数据库。
+    "截至 D" 指 D 当天或之前最近的一个快照日期
+    """
+
+    def __init__(self, data: pd.DataFrame, intervals: pd.DataFrame = None):
+        """
+        :param data: 完整的逐日快照, 列为 index_code, con_code, trade_date, weight
+        :param intervals: 成分股有效区间 (con_code, valid_from, valid_to), 为 None 时由 data 计算
+        """
+        data = data[COLUMNS].drop_duplicates(["trade_date", "con_code"], keep="last")
+        trade_dates = data["trade_date"].values.astype("datetime64[D]")
+        self.dates = np.unique(trade_dates)
+        self.codes = np.unique(data["con_code"].values.astype(str))
+        self.index_code = data["index_code"].iloc[0] if len(data) else None
+        rows = np.searchsorted(self.dates, trade_dates)
+        cols = np.searchsorted(self.codes, data["con_code"].values.astype(str))
+        self.is_member = np.zeros((len(self.dates), len(self.codes)), dtype=bool)
+        self.is_member[rows, cols] = True
+        self.weights = np.full((len(self.dates), len(self.codes)), np.nan)
+        self.weights[rows, cols] = data["weight"].values
+        if intervals is None:
+            intervals = encode(data)[1] if len(data) else pd.DataFrame(
+                columns=["con_code", "valid_from", "valid_to"]
+            )
+        self.intervals = intervals.sort_values(["con_code", "valid_from"]).reset_index(
+            drop=True
+        )
+
+    @classmethod
+    def from_table(cls, engine, table_name, start_date=None, end_date=None):
+        """从完整的成分股表 index_xxx_cons 加载, 可只加载 [start_date, end_date] 内的快照"""
+        query = f"SELECT {', '.join(f'`{c}`' for c in COLUMNS)} FROM `{table_name}` WHERE 1 = 1"
+        params = {}
+        if start_date is not None:
+            query += " AND `trade_date` >= :start_date"
+            params["start_date"] = pd.Timestamp(start_date).date()
+        if end_date is not None:
+            query += " AND `trade_date` <= :end_date"
+            params["end_date"] = pd.Timestamp(end_date).date()
+        data = pd.read_sql_query(text(query), engine, params=params)
+        print(f"从 {table_name} 加载 {len(data)} 条成分股数据")
+        return cls(data)
+
+    @classmethod
+    def from_delta_tables(cls, engine, table_name):
+        """从 index_cons_delta 的紧凑存储加载, 结果与 from_table 相同"""
+        dates_table, members_table, weights_table = delta_tables(table_name)
+        dates = pd.read_sql_query(text(f"SELECT * FROM `{dates_table}`"), engine)
+        intervals = pd.read_sql_query(text(f"SELECT * FROM `{members_table}`"), engine)
+        weights = pd.read_sql_query(text(f"SELECT * FROM `{weights_table}`"), engine)
+        snapshot_dates = np.sort(dates["trade_date"].values.astype("datetime64[D]"))
+        # 每个有效区间展开为区间内的各快照日期, 权重取该日或之前最近一次记录的权重
+        valid_from = intervals["valid_from"].values.astype("datetime64[D]")
+        valid_to = (
+            pd.to_datetime(intervals["valid_to"])
+            .fillna(pd.Timestamp(snapshot_dates[-1]))
+            .values.astype("datetime64[D]")
+        )
+        start = np.searchsorted(snapshot_dates, valid_from)
+        stop = np.searchsorted(snapshot_dates, valid_to, side="right")
+        counts = stop - start
+        positions = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        data = pd.DataFrame(
+            {
+                "con_code": np.repeat(intervals["con_code"].values, counts),
+                "trade_date": snapshot_dates[positions],
+            }
+        )
+        weights = weights.assign(
+            trade_date=weights["trade_date"].values.astype("datetime64[D]")
+        ).sort_values("trade_date")
+        data = pd.merge_asof(
+            data.sort_values("trade_date"),
+            weights[["con_code", "trade_date", "weight"]],
+            on="trade_date",
+            by="con_code",
+        )
+        data.insert(0, "index_code", dates["index_code"].iloc[0])
+        print(f"从 {table_name} 的紧凑存储展开 {len(data)} 条成分股数据")
+        return cls(data, intervals)
+
+    def _rows(self, dates):
+        """各日期截至当日的快照所在行, 早于第一个快照的日期为 -1"""
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        return np.searchsorted(self.dates, dates, side="right") - 1
+
+    def snapshot_date(self, dates):
+        """截至各日期的快照日期, 早于第一个快照时为 NaT"""
+        rows = self._rows(dates)
+        result = np.where(rows >= 0, self.dates[np.maximum(rows, 0)], np.datetime64("NaT"))
+        return result[()] if result.ndim == 0 else result
+
+    def members(self, date) -> pd.DataFrame:
+        """截至 date 的成分股及权重, 列为 con_code, weight, 按 con_code 排序"""
+        row = self._rows(date)[()]
+        if row < 0:
+            return pd.DataFrame(columns=["con_code", "weight"])
+        mask = self.is_member[row]
+        return pd.DataFrame(
+            {"con_code": self.codes[mask], "weight": self.weights[row, mask]}
+        )
+
+    def _columns(self, codes):
+        if codes is None:
+            return self.codes, np.arange(len(self.codes)), np.ones(len(self.codes), bool)
+        codes = np.asarray(codes, dtype=str)
+        cols = np.minimum(np.searchsorted(self.codes, codes), max(len(self.codes) - 1, 0))
+        found = (self.codes[cols] == codes) if len(self.codes) else np.zeros(len(codes), bool)
+        return codes, cols, found
+
+    def weights_asof(self, dates, codes=None) -> pd.DataFrame:
+        """
+        向量化查询: 一组日期截至当日的权重, 行为 dates, 列为 codes(默认所有出现过的成分股),
+        不在成分中的为 NaN
+        """
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        rows = self._rows(dates)
+        codes, cols, found = self._columns(codes)
+        weights = self.weights[np.maximum(rows, 0)][:, cols]
+        member = self.is_member[np.maximum(rows, 0)][:, cols]
+        weights[~(member & found) | (rows < 0)[:, None]] = np.nan
+        return pd.DataFrame(weights, index=pd.DatetimeIndex(dates), columns=codes)
+
+    def members_asof(self, dates, codes=None) -> pd.DataFrame:
+        """向量化查询: 一组日期截至当日各代码是否为成分股, 形状同 weights_asof"""
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        rows = self._rows(dates)
+        codes, cols, found = self._columns(codes)
+        member = self.is_member[np.maximum(rows, 0)][:, cols] & found
+        member[rows < 0] = False
+        return pd.DataFrame(member, index=pd.DatetimeIndex(dates), columns=codes)
+
+    def member_dates(self, code) -> np.ndarray:
+        """code 为成分股的所有快照日期"""
+        _, cols, found = self._columns([code])
+        if not found[0]:
+            return self.dates[:0]
+        return self.dates[self.is_member[:, cols[0]]]
+
+    def code_intervals(self, code) -> pd.DataFrame:
+        """code 的成分有效区间, valid_to 为空表示至今仍在成分中"""
+        return self.intervals[self.intervals["con_code"] == code].reset_index(drop=True)
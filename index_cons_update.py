@@ -1,97 +1,183 @@
 import akshare as ak
 import pandas as pd
-from utils import connect_to_database
-from sqlalchemy import text
+from utils import connect_to_database, map_in_order, source_slot, upsert_dataframe
+from sqlalchemy import bindparam, text
+from index_cons_delta import write_snapshot
+from sqlalchemy.types import Date, String
+import argparse
 import logging
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+# 需要更新的指数列表, 每行一个指数代码, enabled 为 0 的指数跳过
+CONFIG_TABLE = "index_cons_config"
+# 配置表不存在或为空时使用的默认指数
+DEFAULT_SYMBOLS = ["000300", "000985", "000852", "000905"]
+MAX_WORKERS = 4
 
-def main(engine):
-    logging.info("成分股数据更新开始...")
 
-    # Define the indices to process
-    symbols = ["000300", "000985", "000852", "000905"]
+def load_symbols(engine):
+    """从配置表读取需要更新的指数代码, 读取失败或为空时使用 DEFAULT_SYMBOLS"""
+    try:
+        with engine.connect() as connection:
+            symbols = connection.execute(
+                text(
+                    f"SELECT `symbol` FROM `{CONFIG_TABLE}` WHERE `enabled` = 1 ORDER BY `symbol`"
+                )
+            ).scalars().all()
+    except Exception as e:
+        logging.warning(f"读取配置表 '{CONFIG_TABLE}' 失败, 使用默认指数列表: {e}")
+        return DEFAULT_SYMBOLS
+    if not symbols:
+        logging.warning(f"配置表 '{CONFIG_TABLE}' 中没有启用的指数, 使用默认指数列表。")
+        return DEFAULT_SYMBOLS
+    return list(symbols)
 
-    for symbol in symbols:
-        table_name = f"index_{symbol}_cons"
-        logging.info(f"正在处理 index: {symbol} ， 表名: {table_name}")
 
-        # 1. Fetch new data from akshare
-        try:
+def fetch_constituents(symbol):
+    """获取指数最新的成分股及权重, 失败或没有数据时返回 None"""
+    try:
+        with source_slot("csi"):
             new_data_df = ak.index_stock_cons_weight_csindex(symbol=symbol)
-            if new_data_df.empty:
-                logging.warning(f"未返回数据的指数 {symbol} ，跳过处理。")
-                continue
-        except Exception as e:
-            logging.error(f"获取指数 {symbol} 数据失败: {e}")
-            continue  # Move to the next symbol
-
-        # 2. Standardize the DataFrame
-        new_data_df = new_data_df[["指数代码", "成分券代码", "日期", "权重"]]
-        new_data_df = new_data_df.rename(
-            columns={
-                "日期": "trade_date",
-                "指数代码": "index_code",
-                "成分券代码": "con_code",
-                "权重": "weight",
-            }
+        if new_data_df.empty:
+            logging.warning(f"未返回数据的指数 {symbol} ，跳过处理。")
+            return None
+    except Exception as e:
+        logging.error(f"获取指数 {symbol} 数据失败: {e}")
+        return None
+
+    # Standardize the DataFrame
+    new_data_df = new_data_df[["指数代码", "成分券代码", "日期", "权重"]]
+    new_data_df = new_data_df.rename(
+        columns={
+            "日期": "trade_date",
+            "指数代码": "index_code",
+            "成分券代码": "con_code",
+            "权重": "weight",
+        }
+    )
+    # Ensure the date format is consistent before checking the database
+    new_data_df["trade_date"] = pd.to_datetime(new_data_df["trade_date"]).dt.date
+    return new_data_df
+
+
+def find_loaded(engine, trade_dates: dict):
+    """
+    一次查询检查各指数在对应日期的数据是否已入库
+    :param trade_dates: {symbol: trade_date}
+    :return: 已有该日期数据的 symbol 集合
+    """
+    table_names = {symbol: f"index_{symbol}_cons" for symbol in trade_dates}
+    with engine.connect() as connection:
+        existing_tables = set(
+            connection.execute(
+                text(
+                    "SELECT TABLE_NAME FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :table_names"
+                ).bindparams(bindparam("table_names", expanding=True)),
+                {"table_names": list(table_names.values())},
+            ).scalars()
+        )
+        symbols = [
+            symbol for symbol, table in table_names.items() if table in existing_tables
+        ]
+        if not symbols:
+            return set()
+        query = " UNION ALL ".join(
+            f"(SELECT :s{i} AS symbol FROM `{table_names[symbol]}` WHERE trade_date = :d{i} LIMIT 1)"
+            for i, symbol in enumerate(symbols)
         )
+        params = {f"s{i}": symbol for i, symbol in enumerate(symbols)}
+        params.update({f"d{i}": trade_dates[symbol] for i, symbol in enumerate(symbols)})
+        return set(connection.execute(text(query), params).scalars())
 
-        # Ensure the date format is consistent before checking the database
-        new_data_df["trade_date"] = pd.to_datetime(new_data_df["trade_date"]).dt.date
 
-        # Get the trade date from the new data. This is the source of truth.
-        latest_trade_date = new_data_df["trade_date"].iloc[0]
+def main(engine, storage: str = "full"):
+    """
+    :param storage: "full" 每个日期写入完整快照; "delta" 只写入紧凑存储(见 index_cons_delta);
+        "both" 同时写入两种格式
+    """
+    logging.info("成分股数据更新开始...")
 
-        # 3. Check if this date's data already exists in the database
-        data_exists = False
-        try:
-            with engine.connect() as connection:
-                # Use sqlalchemy.text() for safe query parameterization
-                query = text(
-                    f"SELECT 1 FROM `{table_name}` WHERE trade_date = :date LIMIT 1"
-                )
-                result = connection.execute(query, {"date": latest_trade_date}).scalar()
-                if result == 1:
-                    data_exists = True
-        except Exception as e:
-            # This handles the case where the table doesn't exist yet
-            if "no such table" in str(e) or "does not exist" in str(e):
-                logging.info(f"Table '{table_name}' 不存在，将创建新表并插入数据。")
-            else:
-                logging.error(f" '{table_name}' 的数据库检查失败: {e}")
-                continue
-
-        # 4. If data doesn't exist for the date, append it
-        if not data_exists:
+    symbols = load_symbols(engine)
+    logging.info(f"需要处理的指数: {symbols}")
+
+    # 1. 并发获取所有指数的成分股
+    fetched = {
+        symbol: new_data_df
+        for symbol, new_data_df in zip(
+            symbols, map_in_order(fetch_constituents, symbols, max_workers=MAX_WORKERS)
+        )
+        if new_data_df is not None
+    }
+    if not fetched:
+        logging.info("没有获取到任何指数的成分股数据.")
+        return
+
+    # 2. Get the trade date from the new data. This is the source of truth.
+    trade_dates = {
+        symbol: new_data_df["trade_date"].iloc[0]
+        for symbol, new_data_df in fetched.items()
+    }
+
+    if storage in ("delta", "both"):
+        for symbol, new_data_df in fetched.items():
             try:
-                new_data_df.to_sql(
-                    table_name,
-                    engine,
-                    if_exists="append",  # Appends new data; creates table if it doesn't exist
-                    index=False,
-                )
-                logging.info(
-                    f"成功添加 {len(new_data_df)} 条记录到 '{table_name}' 表，日期: {latest_trade_date}."
-                )
+                write_snapshot(engine, f"index_{symbol}_cons", new_data_df)
             except Exception as e:
-                logging.error(f"写入表 '{table_name}' 失败: {e}")
-        else:
+                logging.error(f"写入指数 {symbol} 的紧凑存储失败: {e}")
+        if storage == "delta":
+            logging.info("所有指数数据更新任务已完成.")
+            return
+
+    # 3. 一次查询检查所有指数该日期的数据是否已存在
+    try:
+        loaded = find_loaded(engine, trade_dates)
+    except Exception as e:
+        logging.error(f"数据库检查失败: {e}")
+        return
+
+    # 4. 写入尚未入库的指数, 按 (trade_date, con_code) 合并写入
+    for symbol, new_data_df in fetched.items():
+        table_name = f"index_{symbol}_cons"
+        latest_trade_date = trade_dates[symbol]
+        if symbol in loaded:
             logging.info(
                 f"日期 {latest_trade_date} 的数据已存在于 '{table_name}' 表中，无需更新."
             )
+            continue
+        try:
+            upsert_dataframe(
+                engine,
+                new_data_df,
+                table_name,
+                ["trade_date", "con_code"],
+                dtype={"trade_date": Date, "con_code": String(16)},
+            )
+            logging.info(
+                f"成功添加 {len(new_data_df)} 条记录到 '{table_name}' 表，日期: {latest_trade_date}."
+            )
+        except Exception as e:
+            logging.error(f"写入表 '{table_name}' 失败: {e}")
 
     logging.info("所有指数数据更新任务已完成.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--storage",
+        choices=["full", "delta", "both"],
+        default="full",
+        help="full: 完整快照表; delta: 只存成分和权重变化的紧凑存储; both: 同时写入",
+    )
+    args = parser.parse_args()
     db_engine = connect_to_database()
     if db_engine:
         # Run the main update logic
-        main(db_engine)
+        main(db_engine, storage=args.storage)
         # Dispose of the engine connection pool when the script is finished
         db_engine.dispose()
         logging.info("数据库连接已关闭.")
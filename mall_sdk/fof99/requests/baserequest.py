@@ -16,6 +16,7 @@ class BaseRequest(abc.ABC):
     _headers = None
     _params = None
     _filterer = None
+    _http = requests  # 发送请求的对象, 可替换为 requests.Session 以复用连接或缓存
 
     def __init__(self, appid, appkey, gateway=None):
         self.set_gateway(gateway) \
@@ -98,7 +99,7 @@ class BaseRequest(abc.ABC):
         return self
 
     def _http_get(self, url, params=None, **kwargs):
-        resp = requests.get(url, params=params, **kwargs)
+        resp = self._http.get(url, params=params, **kwargs)
         if resp.status_code != 200:
             self._debug_info = {
                 'error_code': resp.status_code,
@@ -123,7 +124,7 @@ class BaseRequest(abc.ABC):
         return res['data']
 
     def _http_post(self, url, json=None, **kwargs):
-        resp = requests.post(url, json=json, **kwargs)
+        resp = self._http.post(url, json=json, **kwargs)
         if resp.status_code != 200:
             self._debug_info = {
                 'error_code': resp.status_code,
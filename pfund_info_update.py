@@ -1,4 +1,5 @@
 from utils import get_single_company_fund_info
+from trading_calendar import get_trading_calendar
 import numpy as np
 import sqlalchemy
 import os
@@ -10,14 +11,14 @@ if __name__ == "__main__":
     engine = sqlalchemy.create_engine(
         f"mysql+pymysql://dev:{SQL_PASSWORDS}@{SQL_HOST}:3306/UpdatedData?charset=utf8"
     )
-    # 设置为每个交易日盘前运行, 获取昨天的数据, 但是如果周一, 则获取周五的数据
+    # 设置为每个交易日盘前运行, 获取上一个交易日的数据(周一及节后第一天自动回退到节前)
     today = np.datetime64("now").astype("datetime64[D]")
-    weekday = today.astype(object).weekday()  # Monday is 0, Sunday is 6
-    if weekday == 0:
-        delta = 3  # Monday, get Friday's data
-    else:
-        delta = 1  # Other days, get previous day's data
-    prev_trading_day = today - np.timedelta64(delta, "D")
+    calendar = get_trading_calendar()
+    # 定时任务周一至周五都会运行, 工作日节假日时上一个交易日的数据已在节前获取过, 再次追加会重复
+    if not calendar.is_trading_day(today):
+        print(f"{today} 不是交易日, 无需更新。")
+        raise SystemExit(0)
+    prev_trading_day = calendar.prev_trading_day(today)
     all_data_df = get_single_company_fund_info(
         begin_date=str(prev_trading_day),
     )
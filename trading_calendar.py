@@ -0,0 +1,130 @@
+import threading
+import numpy as np
+from functools import lru_cache
+from pathlib import Path
+
+HOLIDAY_FILE = Path(__file__).resolve().parent.joinpath("Chinese_special_holiday.txt")
+# 节假日文件从2015年开始, 交易日历只在此之后准确;
+# 查询更早的日期时日历自动向前扩展, 扩展部分没有节假日信息, 只排除周末
+CALENDAR_BEGIN = np.datetime64("2015-01-01")
+# 向前扩展时在最早的查询日期之前多留的天数, 保证其前一个交易日也在日历内
+EXTEND_MARGIN = np.timedelta64(30, "D")
+
+
+def _to_day(dates):
+    """将 str/date/datetime/Timestamp/datetime64 或其数组统一转换为 datetime64[D]"""
+    if hasattr(dates, "values") and not isinstance(dates, np.ndarray):
+        dates = dates.values  # pd.Series / pd.Index
+    return np.asarray(dates, dtype="datetime64[D]")
+
+
+def _unwrap(result):
+    """0维数组还原为标量"""
+    return result[()] if result.ndim == 0 else result
+
+
+class TradingCalendar:
+    """
+    A股交易日历
+    构建时预先计算 busdaycalendar 和有序的交易日数组, 之后的查询均为向量化的 searchsorted,
+    所有方法既接受单个日期, 也接受日期数组。
+    查询早于 begin 的日期时向前扩展交易日数组(多线程共用时安全), 晚于 end 的日期报错
+    """
+
+    def __init__(self, holidays, begin=CALENDAR_BEGIN, end=None):
+        holidays = np.unique(_to_day(holidays))
+        self.busdaycal = np.busdaycalendar(holidays=holidays)
+        self.begin = _to_day(begin)[()]
+        if end is None:
+            # 覆盖到节假日文件的最后一年和今天之后一年
+            end = max(np.datetime64("today", "D"), holidays.max()) + np.timedelta64(
+                366, "D"
+            )
+        self.end = _to_day(end)[()]
+        days = np.arange(self.begin, self.end + np.timedelta64(1, "D"))
+        self.trading_days = days[np.is_busday(days, busdaycal=self.busdaycal)]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, filepath=HOLIDAY_FILE, **kwargs):
+        """从节假日文件构建交易日历, 忽略空行和 # 开头的注释行"""
+        with open(filepath, "r", encoding="utf-8") as f:
+            holidays = [
+                line.strip() for line in f if line.strip() and not line.startswith("#")
+            ]
+        return cls(holidays, **kwargs)
+
+    def _extend(self, begin):
+        """将日历的起点向前扩展到 begin, 扩展部分只排除周末"""
+        with self._lock:
+            if begin >= self.begin:
+                return
+            days = np.arange(begin, self.begin)
+            self.trading_days = np.concatenate(
+                [days[np.is_busday(days, busdaycal=self.busdaycal)], self.trading_days]
+            )
+            self.begin = begin
+
+    def _search(self, dates, side):
+        """
+        :return: (trading_days, idx), 调用方应使用返回的 trading_days 取值,
+            其他线程扩展日历时 self.trading_days 会被替换
+        """
+        dates = _to_day(dates)
+        if dates.size and dates.min() < self.begin:
+            self._extend(dates.min() - EXTEND_MARGIN)
+        if np.any(dates > self.end):
+            raise ValueError(f"日期超出交易日历范围 {self.begin} ~ {self.end}: {dates}")
+        trading_days = self.trading_days
+        return trading_days, np.searchsorted(trading_days, dates, side=side)
+
+    def is_trading_day(self, dates):
+        """是否为交易日"""
+        return _unwrap(np.is_busday(_to_day(dates), busdaycal=self.busdaycal))
+
+    def prev_trading_day(self, dates, include_self: bool = False):
+        """dates 之前的最近一个交易日, include_self 为 True 时 dates 本身是交易日则返回自身"""
+        trading_days, idx = self._search(dates, "right" if include_self else "left")
+        if np.any(idx == 0):
+            raise ValueError(f"日期之前没有交易日: {dates}")
+        return _unwrap(trading_days[idx - 1])
+
+    def next_trading_day(self, dates, include_self: bool = False):
+        """dates 之后的最近一个交易日, include_self 为 True 时 dates 本身是交易日则返回自身"""
+        trading_days, idx = self._search(dates, "left" if include_self else "right")
+        if np.any(idx == len(trading_days)):
+            raise ValueError(f"日期之后没有交易日: {dates}")
+        return _unwrap(trading_days[idx])
+
+    def offset(self, dates, n: int):
+        """
+        dates 之后第 n 个交易日(n 为负数时为之前), n=0 时返回 dates 当天或之前的最近交易日;
+        非交易日先回退到之前的最近交易日再偏移
+        """
+        trading_days, idx = self._search(dates, "right")
+        idx = idx - 1 + n
+        if np.any(idx < 0) or np.any(idx >= len(trading_days)):
+            raise ValueError(f"偏移 {n} 个交易日后超出交易日历范围: {dates}")
+        return _unwrap(trading_days[idx])
+
+    def trading_days_between(self, begin, end):
+        """[begin, end] 区间内的所有交易日"""
+        # 先按较早的 begin 扩展, 两次查询使用同一个交易日数组
+        self._search(begin, "left")
+        trading_days, end_idx = self._search(end, "right")
+        start_idx = np.searchsorted(trading_days, _to_day(begin), side="left")
+        return trading_days[start_idx:end_idx]
+
+    def week_last_trading_days(self, begin, end):
+        """[begin, end] 区间内每周的最后一个交易日, 区间末尾不完整的一周也会返回其最后一个交易日"""
+        days = self.trading_days_between(begin, end)
+        # 1970-01-01 为周四, +3 后按 7 整除得到以周一为起点的周编号
+        weeks = (days.astype("int64") + 3) // 7
+        is_last = np.append(weeks[:-1] != weeks[1:], True)
+        return days[is_last[: len(days)]]
+
+
+@lru_cache(maxsize=None)
+def get_trading_calendar() -> TradingCalendar:
+    """进程内共享的交易日历, 节假日文件只读取一次"""
+    return TradingCalendar.from_file()
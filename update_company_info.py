@@ -1,36 +1,55 @@
 import sqlalchemy
 import pandas as pd
-from utils import get_company_base_info, update_loc_method
+from utils import update_loc_method
+from amac_manager_directory import load_manager_directory
 from FOF99Api import FOF99Api
 from config import SQL_PASSWORDS, SQL_HOST
 
+# 每积累多少条管理人的更新就写一次数据库
+BATCH_SIZE = 200
+
 engine = sqlalchemy.create_engine(
     f"mysql+pymysql://dev:{SQL_PASSWORDS}@{SQL_HOST}:3306/Euclid?charset=utf8"
 )
 
+
+def flush_updates(updates: dict):
+    """将 {协会名称: {列名: 值}} 一次性写入量化私募管理人列表, 并清空 updates"""
+    if not updates:
+        return
+    update_loc_method(
+        engine=engine,
+        table_name="量化私募管理人列表",
+        key="协会名称",
+        data=pd.DataFrame.from_dict(updates, orient="index"),
+    )
+    updates.clear()
+
+
 # 读取所有数据
 data = pd.read_sql_query("SELECT * FROM Euclid.量化私募管理人列表", engine)
 fof_99 = FOF99Api()
+updates = {}
+# 一次同步中基协管理人名录, 之后在内存中按协会名称批量匹配
+amac_info = load_manager_directory(engine).resolve(data["协会名称"])
 
 for i, row in data.iterrows():
     # if pd.notna(row["管理人名称"]):
     #     continue
 
-    # 1. 依据协会名称从中基协会获取管理人信息
+    # 1. 依据协会名称从中基协管理人名录镜像中获取管理人信息
     print(f"正在更新第{i + 1}条数据: {row['协会名称']}")
-    info = get_company_base_info(row["协会名称"])
-    for data_name, var in {
-        "registerNo": "登记编号",
-        "establishDate": "成立日期",
-        "fundCount": "运作中产品数",
-    }.items():
-        update_loc_method(
-            engine=engine,
-            table_name="量化私募管理人列表",
-            key="协会名称",
-            var=var,
-            data={row["协会名称"]: info[data_name].item()},
-        )
+    info = amac_info.loc[i]
+    row_update = {}
+    if pd.isna(info["registerNo"]):
+        print(f"中基协名录中未找到 {row['协会名称']}")
+    else:
+        for data_name, var in {
+            "registerNo": "登记编号",
+            "establishDate": "成立日期",
+            "fundCount": "运作中产品数",
+        }.items():
+            row_update[var] = info[data_name]
 
     # 2. 依据登记编号从火富牛中获取管理人信息
     registerNo = row["登记编号"]
@@ -42,10 +61,9 @@ for i, row in data.iterrows():
         "member_type": "会员类型",
         "fund_num": "运作中产品数",
     }.items():
-        update_loc_method(
-            engine=engine,
-            table_name="量化私募管理人列表",
-            key="协会名称",
-            var=var,
-            data={row["协会名称"]: company_info[data_name]},
-        )
+        row_update[var] = company_info[data_name]
+    updates[row["协会名称"]] = row_update
+    if len(updates) >= BATCH_SIZE:
+        flush_updates(updates)
+
+flush_updates(updates)
@@ -4,13 +4,31 @@ from utils import update_loc_method
 from FOF99Api import FOF99Api
 from config import SQL_PASSWORDS, SQL_HOST
 
+# 每积累多少条基金的更新就写一次数据库
+BATCH_SIZE = 200
+
 engine = sqlalchemy.create_engine(
     f"mysql+pymysql://dev:{SQL_PASSWORDS}@{SQL_HOST}:3306/Nav?charset=utf8"
 )
 
+
+def flush_updates(updates: dict):
+    """将 {备案编码: {列名: 值}} 一次性写入跟踪产品池, 并清空 updates"""
+    if not updates:
+        return
+    update_loc_method(
+        engine=engine,
+        table_name="跟踪产品池",
+        key="备案编码",
+        data=pd.DataFrame.from_dict(updates, orient="index"),
+    )
+    updates.clear()
+
+
 # 读取所有数据
 data = pd.read_sql_query("SELECT * FROM Nav.跟踪产品池", engine)
 fof_99 = FOF99Api()
+updates = {}
 
 for i, row in data.iterrows():
 
@@ -19,29 +37,21 @@ for i, row in data.iterrows():
     print(f"正在更新第{i + 1}条数据: {row['基金名称']}")
     registerNo = row["备案编码"]
     fund_info = fof_99.get_fund_info(registerNo)
+    row_update = {}
     for data_name, var in {
         "advisor": "管理人",
         "inception_date": "成立日期",
         "puton_date": "备案日期",
     }.items():
-        update_loc_method(
-            engine=engine,
-            table_name="跟踪产品池",
-            key="备案编码",
-            var=var,
-            data={row["备案编码"]: fund_info[data_name]},
-        )
+        row_update[var] = fund_info[data_name]
     company_info = fund_info["FundsBase"]
     for data_name, var in {
         "scale": "管理人规模",
         "register_code": "管理人登记编号",
     }.items():
-        update_loc_method(
-            engine=engine,
-            table_name="跟踪产品池",
-            key="备案编码",
-            var=var,
-            data={row["备案编码"]: company_info[data_name]},
-        )
-    
-    
+        row_update[var] = company_info[data_name]
+    updates[row["备案编码"]] = row_update
+    if len(updates) >= BATCH_SIZE:
+        flush_updates(updates)
+
+flush_updates(updates)
@@ -12,38 +12,47 @@ engine = sqlalchemy.create_engine(
 bench_info_wind = pd.read_sql_query("SELECT * FROM bench_info_wind", engine)
 local_now = np.datetime64("now") + np.timedelta64(8, "h")
 # TODO 1.数据源使用公开的API 2.非交易日也无需更新
-for i, v in bench_info_wind.iterrows():
-    # 检查数据是否需要更新
-    # 因为数据15:00更新, 如果当前时间小于15:00, 则不更新
-    if np.datetime64(v["updated_date"]) < (local_now - np.timedelta64(15, "h")).astype(
-        "datetime64[D]"
-    ):
-        data = wind_warehouse.get_data(
-            code=v["code"],
-            fields="open,high,low,close,pct_chg,volume,amt",
-            begin_date=np.datetime64(v["updated_date"]) + np.timedelta64(1, "D"),
-            freq="D",
-        )
-        data = data[data["AMT"].notna()]
-        data.to_sql(
-            name="bench_basic_data",
-            con=engine.connect(),
-            if_exists="append",
-            index=False,
+# 检查数据是否需要更新
+# 因为数据15:00更新, 如果当前时间小于15:00, 则不更新
+updated_dates = pd.to_datetime(bench_info_wind["updated_date"]).values.astype(
+    "datetime64[D]"
+)
+need_update = updated_dates < (local_now - np.timedelta64(15, "h")).astype(
+    "datetime64[D]"
+)
+for i, v in bench_info_wind[~need_update].iterrows():
+    print(
+        "{} end date is {}, no need to update".format(
+            v["name"], bench_info_wind.loc[i, "updated_date"]
         )
-        bench_info_wind.loc[i, "updated_date"] = data["date"].values[-1]
+    )
+
+# 起始日期相同的代码合并为一次多代码请求
+for updated_date, group in bench_info_wind[need_update].groupby(
+    updated_dates[need_update]
+):
+    data = wind_warehouse.get_data_batch(
+        codes=group["code"].tolist(),
+        fields="open,high,low,close,pct_chg,volume,amt",
+        begin_date=updated_date + np.timedelta64(1, "D"),
+    )
+    data = data[data["AMT"].notna()]
+    data.to_sql(
+        name="bench_basic_data",
+        con=engine.connect(),
+        if_exists="append",
+        index=False,
+    )
+    latest_dates = data.groupby("code")["date"].max()
+    for i, v in group.iterrows():
+        if v["code"] in latest_dates.index:
+            bench_info_wind.loc[i, "updated_date"] = latest_dates[v["code"]]
         print(
             "{} has been updated to {}".format(
                 v["name"], bench_info_wind.loc[i, "updated_date"]
             )
         )
-    else:
-        print(
-            "{} end date is {}, no need to update".format(
-                v["name"], bench_info_wind.loc[i, "updated_date"]
-            )
-        )
-
+    # 每组写入后立即保存最新日期, 后续组失败时已写入的数据不会在下次运行时重复追加
     bench_info_wind.to_sql(
         name="bench_info_wind",
         con=engine.connect(),
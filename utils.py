@@ -1,8 +1,8 @@
-from bs4 import BeautifulSoup
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Literal, Tuple
 from datetime import datetime, timedelta
 import re
@@ -10,18 +10,156 @@ import urllib.parse
 import json
 import uuid
 import time
+import os
+import tempfile
 import sqlalchemy
-from config import SQL_PASSWORDS, SQL_HOST
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config import SQL_PASSWORDS, SQL_HOST, HTTP_CACHE_DIR, HTTP_CACHE_MAX_MB
+from http_cache import CachedSession, ResponseCache
+from trading_calendar import get_trading_calendar
 from sqlalchemy.sql import text
 import akshare as ak
 
 
-def connect_to_database():
-    """创建并返回数据库引擎"""
+# 各数据源允许的最大并发请求数, 同一进程内所有调用方共享
+# ak: akshare 股票日线(新浪), ak_index: akshare 指数日线(东方财富), amac: 中基协信息公示, tinysoft: 天软基差,
+# huofuniu: 火富牛因子收益
+SOURCE_CONCURRENCY = {
+    "ak": 8,
+    "ak_index": 4,
+    "wind": 4,
+    "csi": 4,
+    "cni": 4,
+    "amac": 4,
+    "tinysoft": 4,
+    "huofuniu": 4,
+}
+_source_semaphores = {}
+_source_semaphores_lock = threading.Lock()
+
+
+@contextmanager
+def source_slot(source: str):
+    """占用数据源 source 的一个并发名额, 名额用完时阻塞等待"""
+    with _source_semaphores_lock:
+        if source not in _source_semaphores:
+            _source_semaphores[source] = threading.BoundedSemaphore(
+                SOURCE_CONCURRENCY.get(source, 1)
+            )
+        semaphore = _source_semaphores[source]
+    with semaphore:
+        yield
+
+
+class TokenBucket:
+    """
+    令牌桶限速, 多线程共享: 每秒补充 rate 个令牌, 最多积攒 capacity 个;
+    acquire 在没有令牌时阻塞等待, 用于匹配按分钟计的接口调用配额
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# HTTP (连接超时, 读取超时), 单位秒
+HTTP_TIMEOUT = (5, 30)
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    返回进程内共享的 requests.Session。
+    每个主机一个连接池, 连接保持复用(keep-alive), 并发线程共用同一个 Session;
+    未指定 timeout 的请求使用 HTTP_TIMEOUT。
+    设置了环境变量 HTTP_CACHE_DIR 时启用磁盘响应缓存, 重复运行时相同的请求不再访问网络。
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            cache = (
+                ResponseCache(HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_MB * 1024 * 1024)
+                if HTTP_CACHE_DIR
+                else None
+            )
+            session = CachedSession(cache=cache, timeout=HTTP_TIMEOUT)
+            adapter = HTTPAdapter(
+                pool_connections=16,
+                pool_maxsize=max(SOURCE_CONCURRENCY.values()),
+                max_retries=2,  # 仅重试建立连接失败的情况
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(
+                {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+            )
+            _http_session = session
+    return _http_session
+
+
+def http_get(url, **kwargs) -> requests.Response:
+    """通过共享 Session 发送 GET 请求, 未指定 timeout 时使用 HTTP_TIMEOUT"""
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return get_http_session().get(url, **kwargs)
+
+
+def http_post(url, **kwargs) -> requests.Response:
+    """通过共享 Session 发送 POST 请求, 未指定 timeout 时使用 HTTP_TIMEOUT"""
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return get_http_session().post(url, **kwargs)
+
+
+def map_in_order(func, items, max_workers: int = 1):
+    """
+    用线程池对 items 逐个执行 func, 按 items 的顺序逐个产出结果。
+    在途任务最多 2 * max_workers 个, 避免结果在内存中堆积; max_workers <= 1 时串行执行。
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def connect_to_database(local_infile: bool = False):
+    """
+    创建并返回数据库引擎
+    :param local_infile: 是否允许 LOAD DATA LOCAL INFILE, save_data_to_database 的 "infile" 写入方式需要
+    """
     print("连接到数据库...")
     # 数据库连接
     engine = sqlalchemy.create_engine(
-        f"mysql+pymysql://dev:{SQL_PASSWORDS}@{SQL_HOST}:3306/UpdatedData?charset=utf8"
+        f"mysql+pymysql://dev:{SQL_PASSWORDS}@{SQL_HOST}:3306/UpdatedData?charset=utf8",
+        connect_args={"local_infile": True} if local_infile else {},
     )
     return engine
 
@@ -31,65 +169,133 @@ def update_loc_method(
     table_name: str = "pfund_info",
     key: str = "序号",
     var: str = "净值截至时间",
-    data: dict = {666: "2001-06-06"},
+    data: dict | pd.DataFrame = {666: "2001-06-06"},
     debug: bool = False,
 ):
     """
-    注意data中的value在table中必须是字符串类型, 而且key必须是int类型
-
+    按 key 更新 table_name 中的数据, 所有更新在一个事务中通过临时表一次完成, 值均以参数绑定传入
+    data 为 dict 时: {key值: 新值}, 更新 var 列
+    data 为 DataFrame 时(批量模式): index 为 key 值, 每一列为要更新的列, var 被忽略;
+        值为空(NaN/None)的单元格保持原值不变
     """
+    if isinstance(data, dict):
+        data = pd.DataFrame({var: pd.Series(data, dtype=object)})
+    if data.empty:
+        return
+    columns = list(data.columns)
+    update_df = data.rename_axis(key).reset_index()
+    set_sql = ", ".join(
+        f"t.`{column}` = COALESCE(s.`{column}`, t.`{column}`)" for column in columns
+    )
     with engine.connect() as conn:
         with conn.begin():  # 开启事务
-            for k, v in data.items():
-                sql_text = f"UPDATE {table_name} SET {var} = '{v}' WHERE {key} = '{k}'"
-                res = conn.execute(sqlalchemy.text(sql_text))
-                if debug:
-                    print(f"Executing SQL: {sql_text}")
-                    print(
-                        f"Updated {var} with {v} Where {key} = {k} , affected rows: {res.rowcount}"
-                    )
+            stage_name = _create_stage_table(
+                conn, table_name, [key] + columns, update_df
+            )
+            sql_text = (
+                f"UPDATE `{table_name}` AS t JOIN `{stage_name}` AS s ON t.`{key}` = s.`{key}` "
+                f"SET {set_sql}"
+            )
+            res = conn.execute(sqlalchemy.text(sql_text))
+            if debug:
+                print(f"Executing SQL: {sql_text}")
+                print(
+                    f"Updated {columns} for {len(update_df)} {key} values, affected rows: {res.rowcount}"
+                )
+
+
+def epoch_ms_to_date(series: pd.Series) -> pd.Series:
+    """中基协返回的毫秒时间戳(北京时间零点)向量化转换为 YYYY-MM-DD 字符串"""
+    return (
+        pd.to_datetime(series, unit="ms", utc=True)
+        .dt.tz_convert("Asia/Shanghai")
+        .dt.strftime("%Y-%m-%d")
+    )
+
+
+# 中基协分页请求失败时的重试次数和间隔(秒)
+PAGE_RETRIES = 3
+PAGE_RETRY_WAIT = 2
+
+
+def _get_page_content(get_page, page, data_json):
+    """请求一页并解析 JSON, 失败时重试 PAGE_RETRIES 次, 仍失败返回 None"""
+    for attempt in range(1, PAGE_RETRIES + 1):
+        try:
+            return get_page(page, data_json).json()
+        except Exception as e:
+            print(f"第 {page + 1} 页请求失败({attempt}/{PAGE_RETRIES}): {e}")
+            if attempt < PAGE_RETRIES:
+                time.sleep(PAGE_RETRY_WAIT)
+    return None
+
+
+def get_all_pages(get_page, data_json, size: int = 100, max_workers: int = 4):
+    """
+    获取中基协分页查询的全部记录
+    先请求第一页得到 totalElements, 再并发请求剩余页, 按页码顺序返回所有记录。
+    每页失败时各自重试; 任一页重试后仍失败则放弃本次查询, 不返回缺页的部分结果
+    :param get_page: (page, data_json) -> Response, 如 _get_fund_info
+    :return: 记录列表, 任一页失败时返回 None
+    """
+    first_page = _get_page_content(get_page, 0, data_json)
+    if first_page is None or "totalElements" not in first_page:
+        return None
+    totalElements = first_page["totalElements"]
+    total_pages = -(-totalElements // size)
+    print(f"Processing {total_pages} pages, total elements: {totalElements}")
+    pages = [first_page]
+    pages.extend(
+        map_in_order(
+            lambda page: _get_page_content(get_page, page, data_json),
+            range(1, total_pages),
+            max_workers=max_workers,
+        )
+    )
+    failed = [
+        page + 1
+        for page, content in enumerate(pages)
+        if content is None or "content" not in content
+    ]
+    if failed:
+        print(f"共 {len(failed)} 页获取失败, 放弃本次查询: 第 {failed} 页")
+        return None
+    return [record for page in pages for record in page["content"]]
 
 
 def get_single_company_fund_info(
-    keyword: str = "", begin_date: str = "2025-06-15"
+    keyword: str = "", begin_date: str = "2025-06-15", max_workers: int = 4
 ) -> pd.DataFrame:
-    page = 0
+    """
+    从中基协查询备案日期不早于 begin_date 的私募基金
+    先请求第一页得到总条数, 再并发请求剩余页(并发还受 SOURCE_CONCURRENCY["amac"] 限制), 最后一次性合并
+    """
     size = 100
-    totalElements = 100
-    all_data_df = pd.DataFrame()
     data_json = {
         # "establishDateQuery": {"from": "2025-01-01", "to": "9999-01-01"},
         "putOnRecordDate": {"from": begin_date, "to": "9999-01-01"},
         "keyword": keyword,
     }
-    while totalElements > page * size:
-        res = _get_fund_info(page, data_json)
-        try:
-            totalElements = res.json()["totalElements"]
-        except:
-            return pd.DataFrame()  # 如果没有数据，返回空DataFrame
-        data = pd.DataFrame(res.json()["content"])
-        if len(data) == 0:
-            print("No more data found in {} page {}".format(keyword, page + 1))
-            break
-        data["putOnRecordDate"] = data["putOnRecordDate"].apply(
-            lambda x: time.strftime("%Y-%m-%d", time.localtime(x / 1000))
-        )
-        data["establishDate"] = data["establishDate"].apply(
-            lambda x: time.strftime("%Y-%m-%d", time.localtime(x / 1000))
-        )
-        all_data_df = pd.concat([all_data_df, data], ignore_index=True)
-        print(f"Processing page {page + 1}, total elements: {totalElements}")
-        page += 1
+    records = get_all_pages(_get_fund_info, data_json, size, max_workers)
+    if records is None:
+        print("获取私募基金备案信息失败")
+        return pd.DataFrame()  # 如果没有数据，返回空DataFrame
+    if len(records) == 0:
+        print("No data found in {}".format(keyword))
+        return pd.DataFrame()
+    all_data_df = pd.DataFrame(records)
+    all_data_df["putOnRecordDate"] = epoch_ms_to_date(all_data_df["putOnRecordDate"])
+    all_data_df["establishDate"] = epoch_ms_to_date(all_data_df["establishDate"])
     return all_data_df
 
 
 def _get_fund_info(page, data_json):
-    res = requests.post(
-        "https://gs.amac.org.cn/amac-infodisc/api/pof/fund?",
-        params={"page": page, "size": 100},
-        json=data_json,
-    )
+    with source_slot("amac"):
+        res = http_post(
+            "https://gs.amac.org.cn/amac-infodisc/api/pof/fund?",
+            params={"page": page, "size": 100},
+            json=data_json,
+        )
     return res
 
 
@@ -97,63 +303,81 @@ def get_company_base_info(keyword):
     page = 0
     size = 100
     totalElements = 100
-    all_data_df = pd.DataFrame()
+    pages = []
     data_json = {
         "keyword": keyword,
     }
     while totalElements > page * size:
         res = _get_company_base_info(page, data_json)
         totalElements = res.json()["numberOfElements"]
-        data = pd.DataFrame(res.json()["content"])
-        if len(data) == 0:
+        content = res.json()["content"]
+        if len(content) == 0:
             print("No more data found in {} page {}".format(keyword, page + 1))
             break
-        data["registerDate"] = data["registerDate"].apply(
-            lambda x: time.strftime("%Y-%m-%d", time.localtime(x / 1000))
-        )
-        data["establishDate"] = data["establishDate"].apply(
-            lambda x: time.strftime("%Y-%m-%d", time.localtime(x / 1000))
-        )
-        all_data_df = pd.concat([all_data_df, data], ignore_index=True)
+        pages.append(content)
         page += 1
+    all_data_df = pd.DataFrame([record for content in pages for record in content])
+    if not all_data_df.empty:
+        all_data_df["registerDate"] = epoch_ms_to_date(all_data_df["registerDate"])
+        all_data_df["establishDate"] = epoch_ms_to_date(all_data_df["establishDate"])
+    return all_data_df
+
+
+def get_all_managers(max_workers: int = 4) -> pd.DataFrame:
+    """从中基协获取全部私募管理人名录, 并发分页请求, 只保留标量字段"""
+    records = get_all_pages(_get_company_base_info, {}, max_workers=max_workers)
+    if not records:
+        return pd.DataFrame()
+    all_data_df = pd.DataFrame(records)
+    nested = [
+        column
+        for column in all_data_df.columns
+        if all_data_df[column].map(lambda x: isinstance(x, (dict, list))).any()
+    ]
+    all_data_df = all_data_df.drop(columns=nested)
+    all_data_df["registerDate"] = epoch_ms_to_date(all_data_df["registerDate"])
+    all_data_df["establishDate"] = epoch_ms_to_date(all_data_df["establishDate"])
     return all_data_df
 
 
 def _get_company_base_info(page, data_json):
-    res = requests.post(
-        "https://gs.amac.org.cn/amac-infodisc/api/pof/manager/query",
-        params={"page": page, "size": 100},
-        json=data_json,
-    )
+    with source_slot("amac"):
+        res = http_post(
+            "https://gs.amac.org.cn/amac-infodisc/api/pof/manager/query",
+            params={"page": page, "size": 100},
+            json=data_json,
+        )
     return res
 
 
-def load_bais(type=Literal["IF", "IC", "IM", "IH"]) -> pd.DataFrame:
-    if type == "IF":
-        data = "params=%7B%22head%22%3A%22IF%22%2C%22N%22%3A251%7D&PageID=46803&websiteID=20906&ContentID=Content&UserID=&menup=0&_cb=&_cbdata=&_cbExec=1&_cbDispType=1&__pageState=0&__globalUrlParam=%7B%22PageID%22%3A%2246803%22%2C%22pageid%22%3A%2246803%22%7D&g_randomid=randomid_1051095574548506702800710985&np=%5B%2246803%40Content%40TwebCom_div_1_0%40220907102451613%22%5D&modename=amljaGFfZGFpbHlfY2hhcnRfN0Q5MTQ5NDE%3D&creator=cjzq"
-    elif type == "IC":
-        data = "params=%7B%22head%22%3A%22IC%22%2C%22N%22%3A251%7D&PageID=46803&websiteID=20906&ContentID=Content&UserID=&menup=0&_cb=&_cbdata=&_cbExec=1&_cbDispType=1&__pageState=0&__globalUrlParam=%7B%22PageID%22%3A%2246803%22%2C%22pageid%22%3A%2246803%22%7D&g_randomid=randomid_1051095574548506702800710985&np=%5B%2246803%40Content%40TwebCom_div_1_0%40220907102451613%22%5D&modename=amljaGFfZGFpbHlfY2hhcnRfN0Q5MTQ5NDE%3D&creator=cjzq"
-    elif type == "IM":
-        data = "params=%7B%22head%22%3A%22IM%22%2C%22N%22%3A251%7D&PageID=46803&websiteID=20906&ContentID=Content&UserID=&menup=0&_cb=&_cbdata=&_cbExec=1&_cbDispType=1&__pageState=0&__globalUrlParam=%7B%22PageID%22%3A%2246803%22%2C%22pageid%22%3A%2246803%22%7D&g_randomid=randomid_1051095574548506702800710985&np=%5B%2246803%40Content%40TwebCom_div_1_0%40220907102451613%22%5D&modename=amljaGFfZGFpbHlfY2hhcnRfN0Q5MTQ5NDE%3D&creator=cjzq"
-    elif type == "IH":
-        data = "params=%7B%22head%22%3A%22IH%22%2C%22N%22%3A251%7D&PageID=46803&websiteID=20906&ContentID=Content&UserID=&menup=0&_cb=&_cbdata=&_cbExec=1&_cbDispType=1&__pageState=0&__globalUrlParam=%7B%22PageID%22%3A%2246803%22%2C%22pageid%22%3A%2246803%22%7D&g_randomid=randomid_1051095574548506702800710985&np=%5B%2246803%40Content%40TwebCom_div_1_0%40220907102451613%22%5D&modename=amljaGFfZGFpbHlfY2hhcnRfN0Q5MTQ5NDE%3D&creator=cjzq"
-    else:
+# 天软基差页面的请求参数, 其中 params 的 head/N 在请求时替换为合约类型和天数
+_BASIS_REQUEST_DATA = "params=%7B%22head%22%3A%22IF%22%2C%22N%22%3A251%7D&PageID=46803&websiteID=20906&ContentID=Content&UserID=&menup=0&_cb=&_cbdata=&_cbExec=1&_cbDispType=1&__pageState=0&__globalUrlParam=%7B%22PageID%22%3A%2246803%22%2C%22pageid%22%3A%2246803%22%7D&g_randomid=randomid_1051095574548506702800710985&np=%5B%2246803%40Content%40TwebCom_div_1_0%40220907102451613%22%5D&modename=amljaGFfZGFpbHlfY2hhcnRfN0Q5MTQ5NDE%3D&creator=cjzq"
+
+
+def load_bais(type=Literal["IF", "IC", "IM", "IH"], n: int = 251) -> pd.DataFrame:
+    """
+    从天软获取股指期货 type 最近 n 个交易日的基差数据
+    """
+    if type not in ["IF", "IC", "IM", "IH"]:
         raise ValueError("type must be one of 'IF', 'IC', 'IM', 'IH'")
-    decoded_data = urllib.parse.unquote(data)
+    decoded_data = urllib.parse.unquote(_BASIS_REQUEST_DATA)
     # 解析为字典格式
     parsed_params = urllib.parse.parse_qs(decoded_data)
+    parsed_params["params"] = json.dumps({"head": type, "N": n}, separators=(",", ":"))
     parsed_params["g_randomid"] = "randomid_" + str(uuid.uuid4().int)[:-11]
     updated_data = urllib.parse.urlencode(parsed_params, doseq=True)
-    response = requests.post(
-        "https://web.tinysoft.com.cn/website/loadContentDataAjax.tsl?ref=js",
-        updated_data,
-    )
+    with source_slot("tinysoft"):
+        response = http_post(
+            "https://web.tinysoft.com.cn/website/loadContentDataAjax.tsl?ref=js",
+            data=updated_data,
+        )
 
     data = response.content.decode("utf-8", "ignore")
     data = json.loads(data)
-    soup = BeautifulSoup(data["content"][0]["html"], "html.parser")
-    script_content = soup.find("script").string
-    match = re.search(r"var\s+SrcData\s*=\s*(\[.*?\]);", script_content, re.DOTALL)
+    # 直接在 html 文本中定位 SrcData, 无需构建完整的 DOM 树
+    match = re.search(
+        r"var\s+SrcData\s*=\s*(\[.*?\]);", data["content"][0]["html"], re.DOTALL
+    )
     src_data_raw = match.group(1)
     # 将转义字符转换为实际字符
     src_data = json.loads(src_data_raw.encode().decode("unicode_escape"))
@@ -180,33 +404,23 @@ def generate_trading_date(
     begin_date: np.datetime64 = np.datetime64("2015-01-04"),
     end_date: np.datetime64 = np.datetime64("today"),
 ) -> Tuple[np.ndarray[np.datetime64]]:
+    """
+    :return: (区间内所有交易日, 区间内每个周五当天或之前最近的交易日(去掉第一个周五))
+    """
     assert begin_date >= np.datetime64(
         "2015-01-04"
     ), "系统预设起始日期仅支持2015年1月4日以后"
-    with open(
-        Path(__file__).resolve().parent.joinpath("Chinese_special_holiday.txt"), "r"
-    ) as f:
-        chinese_special_holiday = pd.Series(
-            [date.strip() for date in f.readlines()]
-        ).values.astype("datetime64[D]")
-    working_date = pd.date_range(begin_date, end_date, freq="B").values.astype(
-        "datetime64[D]"
-    )
-    trading_date = np.setdiff1d(working_date, chinese_special_holiday)
-    trading_date_df = pd.DataFrame(working_date, columns=["working_date"])
-    trading_date_df["is_friday"] = trading_date_df["working_date"].apply(
-        lambda x: x.weekday() == 4
-    )
-    trading_date_df["trading_date"] = (
-        trading_date_df["working_date"]
-        .apply(lambda x: x if x in trading_date else np.nan)
-        .ffill()
+    calendar = get_trading_calendar()
+    trading_date = calendar.trading_days_between(begin_date, end_date)
+    working_date = np.arange(
+        np.datetime64(begin_date, "D"), np.datetime64(end_date, "D") + 1
     )
+    # 1970-01-01 为周四, (天数 + 3) % 7 即周一为 0 的星期序号
+    fridays = working_date[(working_date.astype("int64") + 3) % 7 == 4][1:]
+    idx = np.searchsorted(trading_date, fridays, side="right") - 1
     return (
         trading_date,
-        np.unique(
-            trading_date_df[trading_date_df["is_friday"]]["trading_date"].values[1:]
-        ).astype("datetime64[D]"),
+        np.unique(trading_date[idx[idx >= 0]]).astype("datetime64[D]"),
     )
 
 
@@ -222,7 +436,13 @@ def load_holidays(filepath: str) -> list[str]:
 
 
 def is_trading(date, holidays):
-    """检查给定日期是否为交易日"""
+    """
+    检查给定日期是否为交易日
+    date 可以是单个日期, 也可以是 datetime64[D] 数组(此时返回布尔数组);
+    holidays 可以是节假日列表, 也可以是预先构建好的 np.busdaycalendar
+    """
+    if isinstance(holidays, np.busdaycalendar):
+        return np.is_busday(date, busdaycal=holidays)
     is_trading = np.is_busday(date, holidays=holidays)
     return is_trading
 
@@ -252,34 +472,96 @@ def get_latest_dates(engine, table_name: str, group_by_field: str = "code"):
     return latest_dates_df
 
 
-def update_latest_dates(engine, latest_dates_df, info_name):
+def _create_stage_table(connection, table_name: str, columns: list[str], frame):
+    """
+    在当前连接上创建临时表, 列及其类型与 table_name 中的 columns 一致, 并批量写入 frame。
+    临时表只对当前连接可见, 连接关闭后自动删除。
+    :return: 临时表名
+    """
+    stage_name = f"_stage_{table_name}"
+    column_sql = ", ".join(f"`{column}`" for column in columns)
+    connection.execute(text(f"DROP TEMPORARY TABLE IF EXISTS `{stage_name}`"))
+    connection.execute(
+        text(
+            f"CREATE TEMPORARY TABLE `{stage_name}` AS SELECT {column_sql} FROM `{table_name}` LIMIT 0"
+        )
+    )
+    # 列名可能是中文, 绑定参数统一用 p0, p1, ... 命名
+    values = frame[columns].astype(object).where(frame[columns].notna(), None)
+    values.columns = [f"p{i}" for i in range(len(columns))]
+    placeholders = ", ".join(f":{name}" for name in values.columns)
+    connection.execute(
+        text(f"INSERT INTO `{stage_name}` ({column_sql}) VALUES ({placeholders})"),
+        values.to_dict("records"),
+    )  # executemany, pymysql 会合并为多行 INSERT
+    return stage_name
+
+
+def update_latest_dates(engine, latest_dates_df, info_name, advance_only: bool = False):
     """
     更新指定表中的最新日期。
+    所有代码的日期先批量写入临时表, 再用一条 UPDATE ... JOIN 完成更新, 与代码数量无关。
+    :param advance_only: 为 True 时只把日期往后推, 不会覆盖为更早的日期
+    :return: {"changed": 日期有变化的记录数, "unchanged": 日期未变化的记录数}, 出错时返回 None
     """
     if latest_dates_df is None or latest_dates_df.empty:
         print("没有数据提供. Skipping.")
         return
+    stage_df = pd.DataFrame(
+        {
+            "code": latest_dates_df["code"].values,
+            "updated_date": pd.to_datetime(latest_dates_df["latest_date"]).dt.date,
+        }
+    )
     try:
         with engine.connect() as connection:
-            with connection.begin() as transaction:
+            with connection.begin():
                 print(f"--- Starting update for '{info_name}' table ---")
-                latest_dates_df["latest_date"] = pd.to_datetime(
-                    latest_dates_df["latest_date"]
-                ).dt.date
-                for index, row in latest_dates_df.iterrows():
-                    code_to_update = row["code"]
-                    new_date = row["latest_date"]
-                    update_query = text(
-                        f"UPDATE `{info_name}` SET `updated_date` = :new_date WHERE `code` = :code_val"
+                stage_name = _create_stage_table(
+                    connection, info_name, ["code", "updated_date"], stage_df
+                )
+                matched = connection.execute(
+                    text(
+                        f"SELECT COUNT(*) FROM `{info_name}` AS t JOIN `{stage_name}` AS s ON t.`code` = s.`code`"
                     )
-                    connection.execute(
-                        update_query, {"new_date": new_date, "code_val": code_to_update}
+                ).scalar()
+                if advance_only:
+                    condition = "t.`updated_date` IS NULL OR t.`updated_date` < s.`updated_date`"
+                else:
+                    condition = "NOT (t.`updated_date` <=> s.`updated_date`)"
+                changed = connection.execute(
+                    text(
+                        f"UPDATE `{info_name}` AS t JOIN `{stage_name}` AS s ON t.`code` = s.`code` "
+                        f"SET t.`updated_date` = s.`updated_date` "
+                        f"WHERE {condition}"
                     )
-                print(f"成功更新 {len(latest_dates_df)} 条记录.")
+                ).rowcount
+                print(f"成功更新 {changed} 条记录, {matched - changed} 条记录无变化.")
+        return {"changed": changed, "unchanged": matched - changed}
     except Exception as e:
         print(f"An error occurred during the update: {e}")
 
 
+def watermarks_from_frame(data):
+    """根据本次实际写入的数据计算每个代码的最新日期, 格式与 get_latest_dates 的返回值一致"""
+    if data is None or data.empty:
+        return pd.DataFrame(columns=["code", "latest_date"])
+    latest_dates_df = data.groupby("code", as_index=False)["date"].max()
+    latest_dates_df = latest_dates_df.rename(columns={"date": "latest_date"})
+    latest_dates_df["latest_date"] = pd.to_datetime(latest_dates_df["latest_date"])
+    return latest_dates_df
+
+
+def rebuild_watermarks(engine, table_name, info_name):
+    """
+    全表扫描 table_name, 用每个代码的实际最新日期重建 info_name 中的 updated_date。
+    日常运行只按写入的数据增量维护, 仅在数据被手动修改或日期不一致时使用。
+    """
+    print(f"--- 全表扫描 {table_name} 重建 {info_name} 的最新日期 ---")
+    latest_dates_df = get_latest_dates(engine, table_name)
+    return update_latest_dates(engine, latest_dates_df, info_name)
+
+
 def get_source_info(engine, info_name, additional_columns: list[str] = None):
     """
     读取数据获取的参数信息。
@@ -296,312 +578,905 @@ def get_source_info(engine, info_name, additional_columns: list[str] = None):
     return info_df
 
 
-def fetch_akshare_data(
+def _notify(fetch_one, on_data):
+    """包装单个代码的获取函数, 获取到非空数据后立即调用 on_data"""
+    if on_data is None:
+        return fetch_one
+
+    def wrapper(item):
+        data = fetch_one(item)
+        if data is not None and not data.empty:
+            on_data(data)
+        return data
+
+    return wrapper
+
+
+def iter_akshare_data(
     symbols_ak,
     latest_dates_dict,
     today_str,
     data_type: Literal["stock", "index"] = "stock",
+    max_workers: int = 1,
+    on_data=None,
 ):
+    """
+    处理并从akshare获取数据, 以生成器逐个产出每个代码的新数据, 不在内存中累积
+    :param max_workers: 并发线程数, 实际并发还受 SOURCE_CONCURRENCY 中对应数据源的限制;
+        无论并发数多少, 产出的数据及顺序都与 symbols_ak 的顺序一致
+    :param on_data: 每个代码获取到新数据后立即在工作线程中调用 on_data(data),
+        如 SymbolCheckpointWriter
+    """
     assert data_type in [
         "stock",
         "index",
     ], "data_type must be either 'stock' or 'index'"
 
-    """处理并从akshare获取指数数据"""
     print("\n--- 开始处理 akshare 指数数据 ---")
-    data_list = []
-    for code_db, code_ak in symbols_ak.items():
-        print(f"\n>>> 正在处理代码: {code_db}")
-        latest_date = latest_dates_dict.get(code_db)
-        if not latest_date:
-            print(f"警告: 在数据库中未找到代码 {code_db} 的最新日期，跳过。")
-            continue
+    results = map_in_order(
+        _notify(
+            lambda item: _fetch_akshare_single(
+                item[0], item[1], latest_dates_dict.get(item[0]), today_str, data_type
+            ),
+            on_data,
+        ),
+        list(symbols_ak.items()),
+        max_workers=max_workers,
+    )
+    for data in results:
+        if data is not None:
+            yield data
 
-        start_date = (latest_date + timedelta(days=1)).strftime("%Y%m%d")
-        print(f"数据库中最新日期为: {latest_date.date()}, 将从 {start_date} 开始获取。")
 
-        if start_date > today_str:
-            print("数据已是最新，无需更新。")
-            continue
+def fetch_akshare_data(*args, **kwargs):
+    """iter_akshare_data 的列表版本, 一次性返回所有代码的数据"""
+    return list(iter_akshare_data(*args, **kwargs))
 
-        try:
-            # 【重要】注意这里的 symbol 参数用的是字典的 value
-            # 传入latest_date对象，akshare会处理
-            # 判断latest_date是否为周一，若是周一，check_date为上周五
-            if latest_date.weekday() == 0:
-                check_date = (latest_date - timedelta(days=3)).strftime(
-                    "%Y%m%d"
-                )  # akshare如果start或者end为周末，会有数据填充，如果周末包含在区间内则会自动删除
-            else:
-                check_date = latest_date.strftime("%Y%m%d")
-            if data_type == "index":
+
+def _fetch_akshare_single(code_db, code_ak, latest_date, today_str, data_type):
+    """获取单个代码的akshare数据, 无新数据时返回None"""
+    print(f"\n>>> 正在处理代码: {code_db}")
+    if not latest_date:
+        print(f"警告: 在数据库中未找到代码 {code_db} 的最新日期，跳过。")
+        return None
+
+    start_date = (latest_date + timedelta(days=1)).strftime("%Y%m%d")
+    print(f"数据库中最新日期为: {latest_date.date()}, 将从 {start_date} 开始获取。")
+
+    if start_date > today_str:
+        print("数据已是最新，无需更新。")
+        return None
+
+    try:
+        # 【重要】注意这里的 symbol 参数用的是字典的 value
+        # 从latest_date的上一个交易日开始获取, 保证区间内至少有一个已入库的收盘价用于计算涨跌幅
+        # akshare如果start或者end为周末，会有数据填充，从交易日开始可以避免
+        check_date = (
+            pd.Timestamp(get_trading_calendar().prev_trading_day(latest_date))
+        ).strftime("%Y%m%d")
+        if data_type == "index":
+            with source_slot("ak_index"):
                 daily_df = ak.index_zh_a_hist(
                     symbol=code_ak,
                     start_date=check_date,
                     end_date=today_str,
                 )
-                # 数据清洗和处理
-                data = daily_df[
-                    ["日期", "开盘", "最高", "最低", "收盘", "成交量", "成交额"]
-                ].copy()  # 使用 .copy() 避免 SettingWithCopyWarning
-                data.rename(
-                    columns={
-                        "日期": "date",
-                        "开盘": "OPEN",
-                        "最高": "HIGH",
-                        "最低": "LOW",
-                        "收盘": "CLOSE",
-                        "成交量": "VOLUME",
-                        "成交额": "AMT",
-                    },
-                    inplace=True,
-                )
-            elif data_type == "stock":
+            # 数据清洗和处理
+            data = daily_df[
+                ["日期", "开盘", "最高", "最低", "收盘", "成交量", "成交额"]
+            ].copy()  # 使用 .copy() 避免 SettingWithCopyWarning
+            data.rename(
+                columns={
+                    "日期": "date",
+                    "开盘": "OPEN",
+                    "最高": "HIGH",
+                    "最低": "LOW",
+                    "收盘": "CLOSE",
+                    "成交量": "VOLUME",
+                    "成交额": "AMT",
+                },
+                inplace=True,
+            )
+        elif data_type == "stock":
+            with source_slot("ak"):
                 daily_df = ak.stock_zh_a_daily(
                     symbol=code_ak, start_date=check_date, end_date=today_str
                 )
-                # 数据清洗和处理
-                data = daily_df[
-                    ["date", "open", "high", "low", "close", "volume", "amount"]
-                ].copy()  # 使用 .copy() 避免 SettingWithCopyWarning
-                data.rename(
-                    columns={
-                        "open": "OPEN",
-                        "high": "HIGH",
-                        "low": "LOW",
-                        "close": "CLOSE",
-                        "volume": "VOLUME",
-                        "amount": "AMT",
-                    },
-                    inplace=True,
-                )
+            # 数据清洗和处理
+            data = daily_df[
+                ["date", "open", "high", "low", "close", "volume", "amount"]
+            ].copy()  # 使用 .copy() 避免 SettingWithCopyWarning
+            data.rename(
+                columns={
+                    "open": "OPEN",
+                    "high": "HIGH",
+                    "low": "LOW",
+                    "close": "CLOSE",
+                    "volume": "VOLUME",
+                    "amount": "AMT",
+                },
+                inplace=True,
+            )
 
-            if daily_df.empty:
-                print("在指定日期范围内未获取到新数据。")
-                continue
-            print(f"成功获取 {len(data)} 条数据，额外获取了用于计算涨跌幅的数据")
-            data["date"] = pd.to_datetime(data["date"])
-            data["PCT_CHG"] = data["CLOSE"].pct_change() * 100
-            data["code"] = code_db  # 插入用于识别代码的列
-            # 确保使用datetime对象进行比较，以保证准确性
-            data = data[data["date"] >= pd.to_datetime(start_date)]
-            print(f"处理后剩余 {len(data)} 条新数据。")
+        if daily_df.empty:
+            print("在指定日期范围内未获取到新数据。")
+            return None
+        print(f"成功获取 {len(data)} 条数据，额外获取了用于计算涨跌幅的数据")
+        data["date"] = pd.to_datetime(data["date"])
+        data["PCT_CHG"] = data["CLOSE"].pct_change() * 100
+        data["code"] = code_db  # 插入用于识别代码的列
+        # 确保使用datetime对象进行比较，以保证准确性
+        data = data[data["date"] >= pd.to_datetime(start_date)]
+        print(f"处理后剩余 {len(data)} 条新数据。")
+        return data
 
-            data_list.append(data)
+    except Exception as e:
+        print(f"通过 akshare 获取代码 {code_ak} 数据时出错: {e}")
+        return None
 
-        except Exception as e:
-            print(f"通过 akshare 获取代码 {code_ak} 数据时出错: {e}")
-    return data_list
 
+# 截面模式: 全市场快照在收盘后才是当日的完整数据; 符合条件的代码少于该数量时逐个获取更省请求
+SNAPSHOT_READY_TIME = "15:30"
+SNAPSHOT_MIN_CODES = 100
+# 快照的昨收与数据库中前收盘价一致的代码占比低于该值时, 认为快照不是目标交易日的(如日历未收录的节假日)
+SNAPSHOT_MIN_MATCH_RATIO = 0.5
 
-def fetch_wind_data(symbols_wind, latest_dates_dict, today_str):
-    """处理并从Wind获取指数数据"""
+
+def fetch_akshare_snapshot(
+    symbols_ak, latest_dates_dict, engine, table_name, on_data=None
+):
+    """
+    全市场截面模式: 用新浪全市场行情快照(ak.stock_zh_a_spot, 约几十个分页请求)一次获取最近一个交易日所有股票的日线,
+    代替逐个代码调用 ak.stock_zh_a_daily。
+    只有最新日期恰好为该交易日前一个交易日的代码走截面模式, PCT_CHG 按数据库中已存的前收盘价计算;
+    缺口更长、新上市、没有前收盘价或不在快照中的代码仍需逐个获取。
+    快照本身没有日期, 用其昨收与数据库中的前收盘价核对: 不一致的代码(如除权除息)逐个获取,
+    一致的占比低于 SNAPSHOT_MIN_MATCH_RATIO 时快照仍是上一个交易日的, 全部逐个获取
+    :param on_data: 同 iter_akshare_data, 对截面得到的每个代码的数据调用
+    :return: (data_list, rest), data_list 为按代码拆分的新数据, rest 为仍需逐个获取的 symbols_ak 子集
+    """
+    print("\n--- 开始处理 akshare 全市场截面数据 ---")
+    calendar = get_trading_calendar()
+    now = datetime.now()
+    target_date = calendar.prev_trading_day(np.datetime64(now.date()), include_self=True)
+    if (
+        calendar.is_trading_day(np.datetime64(now.date()))
+        and now.strftime("%H:%M") < SNAPSHOT_READY_TIME
+    ):
+        print(f"当前未到 {SNAPSHOT_READY_TIME}, 当日快照不完整, 全部逐个获取。")
+        return [], symbols_ak
+    prev_date = pd.Timestamp(calendar.prev_trading_day(target_date))
+    target_date = pd.Timestamp(target_date)
+
+    candidates = {
+        code: code_ak
+        for code, code_ak in symbols_ak.items()
+        if latest_dates_dict.get(code) == prev_date
+    }
+    if len(candidates) < SNAPSHOT_MIN_CODES:
+        print(f"只有 {len(candidates)} 个代码缺 {target_date.date()} 一天的数据, 全部逐个获取。")
+        return [], symbols_ak
+
+    try:
+        with engine.connect() as connection:
+            prev_close = pd.read_sql_query(
+                text(f"SELECT `code`, `CLOSE` FROM `{table_name}` WHERE `date` = :date"),
+                connection,
+                params={"date": prev_date.date()},
+            )
+        with source_slot("ak"):
+            spot_df = ak.stock_zh_a_spot()
+    except Exception as e:
+        print(f"获取全市场截面数据时出错, 全部逐个获取: {e}")
+        return [], symbols_ak
+
+    codes = pd.Series(list(candidates.keys()), index=list(candidates.values()))
+    spot_df = spot_df[spot_df["代码"].isin(codes.index)]
+    data = pd.DataFrame(
+        {
+            "date": target_date,
+            "OPEN": spot_df["今开"].values,
+            "HIGH": spot_df["最高"].values,
+            "LOW": spot_df["最低"].values,
+            "CLOSE": spot_df["最新价"].values,
+            "VOLUME": spot_df["成交量"].values,
+            "AMT": spot_df["成交额"].values,
+            "SPOT_PREV_CLOSE": spot_df["昨收"].values,
+            "code": codes[spot_df["代码"]].values,
+        }
+    )
+    data = data.merge(
+        prev_close.rename(columns={"CLOSE": "PREV_CLOSE"}), on="code", how="inner"
+    )
+    matched = (data["SPOT_PREV_CLOSE"] - data["PREV_CLOSE"]).abs() < 0.005
+    if len(data) == 0 or matched.mean() < SNAPSHOT_MIN_MATCH_RATIO:
+        print(
+            f"快照的昨收只有 {matched.sum()}/{len(data)} 个与 {prev_date.date()} 的收盘价一致, "
+            f"快照不是 {target_date.date()} 的数据, 全部逐个获取。"
+        )
+        return [], symbols_ak
+    data = data[matched].copy()
+    data["PCT_CHG"] = (data["CLOSE"] / data["PREV_CLOSE"] - 1) * 100
+    covered = set(data["code"])
+    # 成交量为0的是停牌股票, 与逐个获取时一样不写入当日数据
+    suspended = data["VOLUME"] <= 0
+    data = data.loc[
+        ~suspended,
+        ["date", "OPEN", "HIGH", "LOW", "CLOSE", "VOLUME", "AMT", "PCT_CHG", "code"],
+    ]
+
+    rest = {code: code_ak for code, code_ak in symbols_ak.items() if code not in covered}
+    print(
+        f"截面模式获取 {len(data)} 个代码 {target_date.date()} 的数据, "
+        f"{suspended.sum()} 个代码停牌, {len(rest)} 个代码需逐个获取。"
+    )
+    data_list = [frame for _, frame in data.groupby("code", sort=False)]
+    if on_data is not None:
+        for frame in data_list:
+            on_data(frame)
+    return data_list, rest
+
+
+def iter_wind_data(
+    symbols_wind,
+    latest_dates_dict,
+    today_str,
+    max_workers: int = 1,
+    on_data=None,
+    gaps: list = None,
+):
+    """
+    处理并从Wind获取指数数据, max_workers 和 on_data 含义同 iter_akshare_data
+    :param gaps: 不为 None 时, 最大区间仍无法覆盖的缺口以 {"code", "gap_begin", "gap_end"} 追加到其中,
+        由调用方记录; 写入数据后水位线会越过这些缺口, Wind 接口之后也无法再补齐
+    """
     print("\n--- 开始处理 Wind 指数数据 ---")
-    data_list = []
-    for index_code, index_id in symbols_wind.items():
-        print(f"\n>>> 正在处理代码: {index_code}")
-        latest_date = latest_dates_dict.get(index_code)
-        if not latest_date:
-            print(f"警告: 在数据库中未找到代码 {index_code} 的最新日期，跳过。")
-            continue
+    results = map_in_order(
+        _notify(
+            lambda item: _fetch_wind_single(
+                item[0], item[1], latest_dates_dict.get(item[0]), today_str, gaps
+            ),
+            on_data,
+        ),
+        list(symbols_wind.items()),
+        max_workers=max_workers,
+    )
+    for data in results:
+        if data is not None:
+            yield data
 
-        start_date = (latest_date + timedelta(days=1)).strftime("%Y%m%d")
-        if start_date > today_str:
-            print("数据已是最新，无需更新。")
-            continue
 
-        try:
-            url = f"https://indexapi.wind.com.cn/indicesWebsite/api/Kline?indexId={index_id}&period=1Y&lan=cn"
-            res = requests.get(url)
-            data_json = res.json()
-            # 检查返回结果是否有效
-            if not data_json.get("Result") or not data_json["Result"].get("data"):
+def fetch_wind_data(*args, **kwargs):
+    """iter_wind_data 的列表版本, 一次性返回所有代码的数据"""
+    return list(iter_wind_data(*args, **kwargs))
+
+
+# Wind 指数K线接口支持的回看区间及其覆盖的自然日数, 按从小到大排列
+WIND_PERIODS = [("1M", 28), ("3M", 89), ("6M", 181), ("1Y", 365), ("3Y", 1095), ("5Y", 1826)]
+
+
+def _wind_periods(latest_date, today_str):
+    """从能覆盖 latest_date 之后缺口的最小区间开始, 依次返回更大的区间, 用于覆盖不足时逐级扩大"""
+    gap_days = (pd.to_datetime(today_str) - latest_date).days
+    periods = [period for period, days in WIND_PERIODS if days > gap_days]
+    return periods or [WIND_PERIODS[-1][0]]
+
+
+def _fetch_wind_kline(index_id, period):
+    """请求一个区间的Wind指数K线, 无有效数据时返回None"""
+    url = f"https://indexapi.wind.com.cn/indicesWebsite/api/Kline?indexId={index_id}&period={period}&lan=cn"
+    with source_slot("wind"):
+        res = http_get(url)
+    data_json = res.json()
+    # 检查返回结果是否有效
+    if not data_json.get("Result") or not data_json["Result"].get("data"):
+        return None
+
+    data = pd.DataFrame(data_json["Result"]["data"])
+    data = data[
+        [
+            "tradeDate",
+            "open",
+            "hight",
+            "low",
+            "close",
+            "pctChange",
+            "volume",
+            "amount",
+        ]
+    ]
+    data = data.rename(
+        columns={
+            "tradeDate": "date",
+            "open": "OPEN",
+            "hight": "HIGH",
+            "low": "LOW",
+            "close": "CLOSE",
+            "pctChange": "PCT_CHG",
+            "volume": "VOLUME",
+            "amount": "AMT",
+        }
+    )
+    data["date"] = pd.to_datetime(data["date"], format="%Y%m%d")
+    return data
+
+
+def _fetch_wind_single(index_code, index_id, latest_date, today_str, gaps=None):
+    """
+    获取单个代码的Wind数据, 无新数据时返回None
+    按缺口大小选择最小的回看区间, 返回的数据未覆盖到缺口的第一个交易日时逐级扩大区间;
+    最大区间仍不能覆盖时只写入已获取的部分, 缺失的日期范围追加到 gaps
+    """
+    print(f"\n>>> 正在处理代码: {index_code}")
+    if not latest_date:
+        print(f"警告: 在数据库中未找到代码 {index_code} 的最新日期，跳过。")
+        return None
+
+    start_date = (latest_date + timedelta(days=1)).strftime("%Y%m%d")
+    if start_date > today_str:
+        print("数据已是最新，无需更新。")
+        return None
+
+    try:
+        first_day = pd.Timestamp(get_trading_calendar().next_trading_day(latest_date))
+        periods = _wind_periods(latest_date, today_str)
+        for i, period in enumerate(periods):
+            data = _fetch_wind_kline(index_id, period)
+            if data is None:
                 print(f"Wind API 未返回代码 {index_code} 的有效数据。")
-                continue
-
-            data = pd.DataFrame(data_json["Result"]["data"])
-            data = data[
-                [
-                    "tradeDate",
-                    "open",
-                    "hight",
-                    "low",
-                    "close",
-                    "pctChange",
-                    "volume",
-                    "amount",
-                ]
-            ]
-            data = data.rename(
-                columns={
-                    "tradeDate": "date",
-                    "open": "OPEN",
-                    "hight": "HIGH",
-                    "low": "LOW",
-                    "close": "CLOSE",
-                    "pctChange": "PCT_CHG",
-                    "volume": "VOLUME",
-                    "amount": "AMT",
-                }
-            )
-            data["date"] = pd.to_datetime(data["date"], format="%Y%m%d")
-
-            new_data = data[
-                data["date"] >= pd.to_datetime(start_date)
-            ].copy()  # 使用.copy()避免警告
-            new_data["code"] = index_code  # 插入用于识别代码的列
-            print(f"成功获取 {len(new_data)} 条新数据。")
-            data_list.append(new_data)
-        except Exception as e:
-            print(f"处理 Wind 代码 {index_code} 时出错: {e}")
-    return data_list
+                return None
+            # 返回的数据包含缺口的第一个交易日(或更早)时, 说明缺口已被完全覆盖
+            if data["date"].min() <= first_day:
+                break
+            if i == len(periods) - 1:
+                gap_end = pd.Timestamp(
+                    get_trading_calendar().prev_trading_day(data["date"].min())
+                )
+                print(
+                    f"警告: 代码 {index_code} 最大区间仍未覆盖缺口, "
+                    f"{first_day.date()} 至 {gap_end.date()} 之间的数据缺失。"
+                )
+                if gaps is not None:
+                    gaps.append(
+                        {
+                            "code": index_code,
+                            "gap_begin": first_day.date(),
+                            "gap_end": gap_end.date(),
+                        }
+                    )
+            else:
+                print(f"区间 {period} 只覆盖到 {data['date'].min().date()}, 扩大区间重新获取。")
 
+        new_data = data[
+            data["date"] >= pd.to_datetime(start_date)
+        ].copy()  # 使用.copy()避免警告
+        new_data["code"] = index_code  # 插入用于识别代码的列
+        print(f"区间 {period}: 成功获取 {len(new_data)} 条新数据。")
+        return new_data
+    except Exception as e:
+        print(f"处理 Wind 代码 {index_code} 时出错: {e}")
+        return None
 
-def fetch_csi_data(symbols_csi, latest_dates_dict, today_str):
-    """处理并从中证获取指数数据"""
+
+def iter_csi_data(
+    symbols_csi, latest_dates_dict, today_str, max_workers: int = 1, on_data=None
+):
+    """处理并从中证获取指数数据, max_workers 和 on_data 含义同 iter_akshare_data"""
     print("\n--- 开始处理 中证 指数数据 ---")
-    data_list = []
-    for code, code_csi in symbols_csi.items():
-        print(f"\n>>> 正在处理代码: {code}")
-        latest_date = latest_dates_dict.get(code)
-        if not latest_date:
-            print(f"警告: 在数据库中未找到代码 {code} 的最新日期，跳过。")
-            continue
+    results = map_in_order(
+        _notify(
+            lambda item: _fetch_csi_single(
+                item[0], item[1], latest_dates_dict.get(item[0]), today_str
+            ),
+            on_data,
+        ),
+        list(symbols_csi.items()),
+        max_workers=max_workers,
+    )
+    for data in results:
+        if data is not None:
+            yield data
 
-        start_date = (latest_date + timedelta(days=1)).strftime("%Y%m%d")
-        if start_date > today_str:
-            print("数据已是最新，无需更新。")
-            continue
-        print(f"数据库中最新日期为: {latest_date.date()}, 将从 {start_date} 开始获取。")
 
-        try:
-            url = f"https://www.csindex.com.cn/csindex-home/perf/index-perf?indexCode={code_csi}&startDate={start_date}&endDate={today_str}"
-            res = requests.get(url)
-            data_json = res.json()
-            if not data_json.get("data"):
-                print("中证 API 未返回有效数据。")
-                continue
-
-            data = pd.DataFrame(data_json["data"])[
-                [
-                    "tradeDate",
-                    "open",
-                    "high",
-                    "low",
-                    "close",
-                    "tradingVol",
-                    "tradingValue",
-                    "changePct",
-                ]
+def fetch_csi_data(*args, **kwargs):
+    """iter_csi_data 的列表版本, 一次性返回所有代码的数据"""
+    return list(iter_csi_data(*args, **kwargs))
+
+
+def _fetch_csi_single(code, code_csi, latest_date, today_str):
+    """获取单个代码的中证数据, 无新数据时返回None"""
+    print(f"\n>>> 正在处理代码: {code}")
+    if not latest_date:
+        print(f"警告: 在数据库中未找到代码 {code} 的最新日期，跳过。")
+        return None
+
+    start_date = (latest_date + timedelta(days=1)).strftime("%Y%m%d")
+    if start_date > today_str:
+        print("数据已是最新，无需更新。")
+        return None
+    print(f"数据库中最新日期为: {latest_date.date()}, 将从 {start_date} 开始获取。")
+
+    try:
+        url = f"https://www.csindex.com.cn/csindex-home/perf/index-perf?indexCode={code_csi}&startDate={start_date}&endDate={today_str}"
+        with source_slot("csi"):
+            res = http_get(url)
+        data_json = res.json()
+        if not data_json.get("data"):
+            print("中证 API 未返回有效数据。")
+            return None
+
+        data = pd.DataFrame(data_json["data"])[
+            [
+                "tradeDate",
+                "open",
+                "high",
+                "low",
+                "close",
+                "tradingVol",
+                "tradingValue",
+                "changePct",
             ]
-            data = data.rename(
-                columns={
-                    "tradeDate": "date",
-                    "open": "OPEN",
-                    "high": "HIGH",
-                    "low": "LOW",
-                    "close": "CLOSE",
-                    "tradingVol": "VOLUME",
-                    "tradingValue": "AMT",
-                    "changePct": "PCT_CHG",
-                }
-            )
-            data["VOLUME"] *= 1e6
-            data["AMT"] *= 1e8
-            data["code"] = code  # 插入用于识别代码的列
-            data["date"] = pd.to_datetime(data["date"])
-            print(f"成功获取 {len(data)} 条新数据。")
-            data_list.append(data)
-        except Exception as e:
-            print(f"处理中证代码 {code} 时出错: {e}")
-    return data_list
+        ]
+        data = data.rename(
+            columns={
+                "tradeDate": "date",
+                "open": "OPEN",
+                "high": "HIGH",
+                "low": "LOW",
+                "close": "CLOSE",
+                "tradingVol": "VOLUME",
+                "tradingValue": "AMT",
+                "changePct": "PCT_CHG",
+            }
+        )
+        data["VOLUME"] *= 1e6
+        data["AMT"] *= 1e8
+        data["code"] = code  # 插入用于识别代码的列
+        data["date"] = pd.to_datetime(data["date"])
+        print(f"成功获取 {len(data)} 条新数据。")
+        return data
+    except Exception as e:
+        print(f"处理中证代码 {code} 时出错: {e}")
+        return None
 
 
-def fetch_cni_data(symbols_cni, latest_dates_dict, today_str):
-    """处理并从国证获取指数数据"""
+def iter_cni_data(
+    symbols_cni, latest_dates_dict, today_str, max_workers: int = 1, on_data=None
+):
+    """处理并从国证获取指数数据, max_workers 和 on_data 含义同 iter_akshare_data"""
     print("\n--- 开始处理 国证 指数数据 ---")
-    data_list = []
-    for code, code_cni in symbols_cni.items():
-        print(f"\n>>> 正在处理代码: {code}")
-        latest_date = latest_dates_dict.get(code)
-        if not latest_date:
-            print(f"警告: 在数据库中未找到代码 {code} 的最新日期，跳过。")
-            continue
+    results = map_in_order(
+        _notify(
+            lambda item: _fetch_cni_single(
+                item[0], item[1], latest_dates_dict.get(item[0]), today_str
+            ),
+            on_data,
+        ),
+        list(symbols_cni.items()),
+        max_workers=max_workers,
+    )
+    for data in results:
+        if data is not None:
+            yield data
 
-        start_date = (latest_date + timedelta(days=1)).strftime("%Y%m%d")
-        check_date = (latest_date + timedelta(days=1)).strftime("%Y-%m-%d")
-        today_date = datetime.now().strftime("%Y-%m-%d")
-        if start_date > today_str:
-            print("数据已是最新，无需更新。")
-            continue
-        print(f"数据库中最新日期为: {latest_date.date()}, 将从 {start_date} 开始获取。")
 
-        try:
-            url = f"https://hq.cnindex.com.cn/market/market/getIndexDailyDataWithDataFormat?indexCode={code_cni}&startDate={check_date}&endDate={today_date}&frequency=day"
-            res = requests.get(url)
-            data_json = res.json()["data"]
-            if not data_json:
-                print("国证 API 未返回有效数据。")
-                continue
-
-            data = pd.DataFrame(data_json["data"], columns=data_json["item"])[
-                [
-                    "timestamp",
-                    "high",
-                    "open",
-                    "low",
-                    "close",
-                    "percent",
-                    "amount",
-                    "volume",
-                ]
+def fetch_cni_data(*args, **kwargs):
+    """iter_cni_data 的列表版本, 一次性返回所有代码的数据"""
+    return list(iter_cni_data(*args, **kwargs))
+
+
+def _fetch_cni_single(code, code_cni, latest_date, today_str):
+    """获取单个代码的国证数据, 无新数据时返回None"""
+    print(f"\n>>> 正在处理代码: {code}")
+    if not latest_date:
+        print(f"警告: 在数据库中未找到代码 {code} 的最新日期，跳过。")
+        return None
+
+    start_date = (latest_date + timedelta(days=1)).strftime("%Y%m%d")
+    check_date = (latest_date + timedelta(days=1)).strftime("%Y-%m-%d")
+    today_date = datetime.now().strftime("%Y-%m-%d")
+    if start_date > today_str:
+        print("数据已是最新，无需更新。")
+        return None
+    print(f"数据库中最新日期为: {latest_date.date()}, 将从 {start_date} 开始获取。")
+
+    try:
+        url = f"https://hq.cnindex.com.cn/market/market/getIndexDailyDataWithDataFormat?indexCode={code_cni}&startDate={check_date}&endDate={today_date}&frequency=day"
+        with source_slot("cni"):
+            res = http_get(url)
+        data_json = res.json()["data"]
+        if not data_json:
+            print("国证 API 未返回有效数据。")
+            return None
+
+        data = pd.DataFrame(data_json["data"], columns=data_json["item"])[
+            [
+                "timestamp",
+                "high",
+                "open",
+                "low",
+                "close",
+                "percent",
+                "amount",
+                "volume",
             ]
-            data = data.rename(
-                columns={
-                    "timestamp": "date",
-                    "open": "OPEN",
-                    "high": "HIGH",
-                    "low": "LOW",
-                    "close": "CLOSE",
-                    "volume": "VOLUME",
-                    "amount": "AMT",
-                    "percent": "PCT_CHG",
-                }
-            )
-            data["code"] = code  # 插入用于识别代码的列
-            data["date"] = pd.to_datetime(data["date"])
-            print(f"成功获取 {len(data)} 条新数据。")
-            data_list.append(data)
-        except Exception as e:
-            print(f"处理国证代码 {code} 时出错: {e}")
-    return data_list
+        ]
+        data = data.rename(
+            columns={
+                "timestamp": "date",
+                "open": "OPEN",
+                "high": "HIGH",
+                "low": "LOW",
+                "close": "CLOSE",
+                "volume": "VOLUME",
+                "amount": "AMT",
+                "percent": "PCT_CHG",
+            }
+        )
+        data["code"] = code  # 插入用于识别代码的列
+        data["date"] = pd.to_datetime(data["date"])
+        print(f"成功获取 {len(data)} 条新数据。")
+        return data
+    except Exception as e:
+        print(f"处理国证代码 {code} 时出错: {e}")
+        return None
+
+
+def filter_trading_days(data, holidays=None):
+    """
+    只保留交易日的数据, 并将 date 列转换为日期类型
+    :param holidays: 节假日列表或 np.busdaycalendar, 为 None 时使用 get_trading_calendar()
+    """
+    dates = pd.to_datetime(data["date"])
+    # 一次性向量化判断所有日期是否为交易日
+    if holidays is None:
+        holidays = get_trading_calendar().busdaycal
+    elif not isinstance(holidays, np.busdaycalendar):
+        holidays = np.busdaycalendar(holidays=holidays)
+    mask = is_trading(dates.values.astype("datetime64[D]"), holidays)
+    data = data.copy()
+    data["date"] = dates.dt.date  # 确保date列是日期类型
+    return data[mask]
 
 
-def save_data_to_database(all_new_data, table_name, engine, holidays):
-    """合并数据，过滤并写入数据库"""
+def save_data_to_database(
+    all_new_data,
+    table_name,
+    engine,
+    holidays=None,
+    write_method: Literal["multi", "infile"] = "multi",
+    chunksize: int = 5000,
+    mode: Literal["append", "upsert"] = "append",
+):
+    """
+    合并数据，过滤并写入数据库
+    :param holidays: 节假日列表或 np.busdaycalendar, 为 None 时使用 get_trading_calendar()
+    :param write_method: "multi" 为分块的多行 INSERT;
+        "infile" 为 LOAD DATA LOCAL INFILE, 需要 connect_to_database(local_infile=True) 创建的引擎,
+        失败时自动退回 "multi"
+    :param chunksize: "multi" 模式下每条 INSERT 的行数
+    :param mode: "append" 直接追加; "upsert" 按 (code, date) 合并, 重复运行不会产生重复数据,
+        此时 write_method 不生效, 写入失败时抛出异常(表中已有重复数据时需先去重)
+    :return: 成功写入的数据, 没有数据或 "append" 写入失败时返回 None
+    """
     print("\n--- 写入数据库 ---")
 
     if all_new_data:
-        final_df = pd.concat(all_new_data, ignore_index=True)
-        final_df["date"] = pd.to_datetime(
-            final_df["date"]
-        ).dt.date  # 确保date列是日期类型
-        mask = final_df["date"].apply(lambda d: is_trading(d, holidays))
-        final_df = final_df[mask]
+        final_df = filter_trading_days(
+            pd.concat(all_new_data, ignore_index=True), holidays
+        )
         print(f"过滤后，剩余 {len(final_df)} 条交易日数据。")
 
         print(f"总计 {len(final_df)} 条新数据将被写入数据库。")
 
+        if mode == "upsert":
+            # 失败时不退回直接追加, 否则会写入 upsert 要避免的重复数据(如表中已有重复数据导致无法创建唯一索引)
+            try:
+                upsert_dataframe(engine, final_df, table_name, ["code", "date"])
+            except Exception as e:
+                print(f"\nupsert 写入失败: {e}")
+                raise
+            print("\n数据成功写入数据库！")
+            return final_df
+
         try:
+            if write_method == "infile":
+                try:
+                    _load_data_infile(final_df, table_name, engine)
+                    print("\n数据成功写入数据库！")
+                    return final_df
+                except Exception as e:
+                    print(f"LOAD DATA LOCAL INFILE 写入失败, 改用多行 INSERT: {e}")
             final_df.to_sql(
                 name=table_name,
                 con=engine,
                 if_exists="append",
                 index=False,
                 dtype={"date": sqlalchemy.types.Date},  # 明确指定date列的类型
+                method="multi",
+                chunksize=chunksize,
             )
             print("\n数据成功写入数据库！")
+            return final_df
         except Exception as e:
             print(f"\n数据写入数据库时发生错误: {e}")
     else:
         print("\n任务完成，没有新数据需要写入数据库。")
+
+
+def _load_data_infile(data, table_name, engine):
+    """通过 LOAD DATA LOCAL INFILE 将 data 批量写入 table_name, 表不存在时先按 data 建表"""
+    # 只建表不写数据
+    data.head(0).to_sql(
+        name=table_name,
+        con=engine,
+        if_exists="append",
+        index=False,
+        dtype={"date": sqlalchemy.types.Date},
+    )
+    column_sql = ", ".join(f"`{column}`" for column in data.columns)
+    # pymysql 只能按文件名读取本地文件, 因此先写入临时文件
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".csv", encoding="utf-8", newline="", delete=False
+    ) as f:
+        data.to_csv(f, index=False, header=False, na_rep="\\N", lineterminator="\n")
+        file_path = f.name
+    try:
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"LOAD DATA LOCAL INFILE :file_path INTO TABLE `{table_name}` "
+                    "CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' "
+                    "OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+                    f"({column_sql})"
+                ),
+                {"file_path": file_path},
+            )
+    finally:
+        os.remove(file_path)
+
+
+# 流式写入时各数据源与写入线程之间的队列长度(按每个代码的 DataFrame 计)
+STREAM_QUEUE_SIZE = 32
+# 写入缓冲区达到任一阈值即写入数据库一次
+STREAM_FLUSH_ROWS = 200_000
+STREAM_FLUSH_BYTES = 256 * 1024 * 1024
+_STREAM_DONE = object()
+
+
+def iter_concurrently(sources, queue_size: int = STREAM_QUEUE_SIZE):
+    """
+    每个数据源(iter_* 返回的生成器)在独立线程中运行, 通过有界队列按到达顺序合并产出;
+    队列满时数据源线程阻塞等待, 在途数据最多 queue_size 个。数据源抛出的异常会在此处重新抛出
+    """
+    frames = queue.Queue(maxsize=queue_size)
+
+    def produce(source):
+        try:
+            for data in source:
+                frames.put(data)
+        except Exception as e:
+            frames.put(e)
+        finally:
+            frames.put(_STREAM_DONE)
+
+    for source in sources:
+        threading.Thread(target=produce, args=(source,), daemon=True).start()
+    remaining = len(sources)
+    while remaining:
+        data = frames.get()
+        if data is _STREAM_DONE:
+            remaining -= 1
+        elif isinstance(data, Exception):
+            raise data
+        else:
+            yield data
+
+
+def stream_to_database(
+    frames,
+    table_name,
+    engine,
+    info_name: str = None,
+    flush_rows: int = STREAM_FLUSH_ROWS,
+    flush_bytes: int = STREAM_FLUSH_BYTES,
+    mode: Literal["append", "upsert"] = "upsert",
+):
+    """
+    逐个接收 DataFrame 并分批写入数据库, 缓冲的行数或内存占用达到阈值时写入一次,
+    峰值内存由阈值和上游队列长度决定, 与数据总量无关
+    :param frames: DataFrame 的可迭代对象, 如 iter_concurrently 的返回值
+    :param info_name: 不为 None 时每批写入后按写入的数据推进 info 表中的最新日期
+    :param mode: 同 save_data_to_database
+    :return: {"rows": 写入的行数, "batches": 写入的批数}
+    """
+    buffer, buffer_rows, buffer_bytes = [], 0, 0
+    stats = {"rows": 0, "batches": 0}
+
+    def flush():
+        written = save_data_to_database(buffer, table_name, engine, mode=mode)
+        if written is None:
+            return
+        stats["rows"] += len(written)
+        stats["batches"] += 1
+        if info_name is not None:
+            update_latest_dates(
+                engine, watermarks_from_frame(written), info_name, advance_only=True
+            )
+
+    for data in frames:
+        if data.empty:
+            continue
+        buffer.append(data)
+        buffer_rows += len(data)
+        buffer_bytes += int(data.memory_usage(deep=True).sum())
+        if buffer_rows >= flush_rows or buffer_bytes >= flush_bytes:
+            flush()
+            buffer, buffer_rows, buffer_bytes = [], 0, 0
+    if buffer:
+        flush()
+    print(f"流式写入完成: 共 {stats['rows']} 条数据, 分 {stats['batches']} 批写入 {table_name}")
+    return stats
+
+
+def ensure_unique_key(engine, table_name: str, key_columns: list[str]):
+    """
+    确保 table_name 上存在由 key_columns 组成的唯一索引, 不存在时创建。
+    文本类型的列使用前缀索引; 表中已有重复数据时创建会失败, 需要先去重。
+    """
+    with engine.connect() as connection:
+        index_columns = connection.execute(
+            text(
+                "SELECT INDEX_NAME, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) "
+                "FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND NON_UNIQUE = 0 "
+                "GROUP BY INDEX_NAME"
+            ),
+            {"table_name": table_name},
+        ).fetchall()
+        if any(columns.split(",") == key_columns for _, columns in index_columns):
+            return
+        column_types = dict(
+            connection.execute(
+                text(
+                    "SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name"
+                ),
+                {"table_name": table_name},
+            ).fetchall()
+        )
+    key_sql = ", ".join(
+        (
+            f"`{column}`(64)"
+            if column_types.get(column, "").endswith(("text", "blob"))
+            else f"`{column}`"
+        )
+        for column in key_columns
+    )
+    print(f"为 {table_name} 创建唯一索引 ({', '.join(key_columns)})")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                f"ALTER TABLE `{table_name}` ADD UNIQUE KEY `uk_{'_'.join(key_columns)}` ({key_sql})"
+            )
+        )
+
+
+def prepare_upsert_table(
+    engine, data, table_name: str, key_columns: list[str], dtype: dict = None
+):
+    """表不存在时按 data 建表(dtype 同 to_sql, 默认 date 列为 Date 类型), 并确保 key_columns 上有唯一索引"""
+    if dtype is None and "date" in data.columns:
+        dtype = {"date": sqlalchemy.types.Date}
+    # 只建表不写数据
+    data.head(0).to_sql(
+        name=table_name,
+        con=engine,
+        if_exists="append",
+        index=False,
+        dtype=dtype,
+    )
+    ensure_unique_key(engine, table_name, key_columns)
+
+
+def merge_into_table(connection, data, table_name: str, key_columns: list[str]):
+    """
+    在调用方的事务中将 data 按 key_columns 合并写入 table_name, 表需已由 prepare_upsert_table 准备好
+    :return: {"inserted": 新增行数, "updated": 有变化的行数, "unchanged": 无变化的行数}
+    """
+    data = data.drop_duplicates(subset=key_columns, keep="last")
+    columns = list(data.columns)
+    value_columns = [column for column in columns if column not in key_columns]
+    column_sql = ", ".join(f"`{column}`" for column in columns)
+    join_sql = " AND ".join(f"t.`{column}` = s.`{column}`" for column in key_columns)
+    same_sql = " AND ".join(
+        f"t.`{column}` <=> s.`{column}`" for column in value_columns
+    ) or "TRUE"
+    update_sql = ", ".join(
+        f"`{column}` = VALUES(`{column}`)" for column in value_columns
+    ) or f"`{key_columns[0]}` = `{key_columns[0]}`"
+    stage_name = _create_stage_table(connection, table_name, columns, data)
+    inserted, updated = connection.execute(
+        text(
+            f"SELECT COALESCE(SUM(t.`{key_columns[0]}` IS NULL), 0), "
+            f"COALESCE(SUM(t.`{key_columns[0]}` IS NOT NULL AND NOT ({same_sql})), 0) "
+            f"FROM `{stage_name}` AS s LEFT JOIN `{table_name}` AS t ON {join_sql}"
+        )
+    ).one()
+    connection.execute(
+        text(
+            f"INSERT INTO `{table_name}` ({column_sql}) "
+            f"SELECT {column_sql} FROM `{stage_name}` "
+            f"ON DUPLICATE KEY UPDATE {update_sql}"
+        )
+    )
+    return {
+        "inserted": int(inserted),
+        "updated": int(updated),
+        "unchanged": len(data) - int(inserted) - int(updated),
+    }
+
+
+def upsert_dataframe(
+    engine, data, table_name: str, key_columns: list[str], dtype: dict = None
+):
+    """
+    将 data 按 key_columns 合并写入 table_name (INSERT ... ON DUPLICATE KEY UPDATE)。
+    表不存在时按 data 建表(dtype 同 to_sql, 默认 date 列为 Date 类型), 并确保 key_columns 上有唯一索引。
+    :return: {"inserted": 新增行数, "updated": 有变化的行数, "unchanged": 无变化的行数}
+    """
+    prepare_upsert_table(engine, data, table_name, key_columns, dtype)
+    with engine.connect() as connection:
+        with connection.begin():
+            counts = merge_into_table(connection, data, table_name, key_columns)
+    print(
+        f"{table_name}: 新增 {counts['inserted']} 条, 更新 {counts['updated']} 条, 无变化 {counts['unchanged']} 条"
+    )
+    return counts
+
+
+class SymbolCheckpointWriter:
+    """
+    逐个代码写入数据的检查点写入器
+    每个代码的新数据与其在 info 表中的最新日期在同一个事务中提交, 任一步失败则该代码整体回滚,
+    重跑时只需重新获取失败的代码; 可直接作为 fetch_* 函数的 on_data 回调, 多线程调用安全
+    """
+
+    def __init__(self, engine, table_name, info_name, holidays=None):
+        self.engine = engine
+        self.table_name = table_name
+        self.info_name = info_name
+        self.holidays = holidays
+        self.completed = []
+        self.failed = []
+        self._prepared = False
+        self._lock = threading.Lock()
+
+    def __call__(self, data):
+        code = data["code"].iloc[0]
+        data = filter_trading_days(data, self.holidays)
+        if data.empty:
+            return
+        try:
+            with self._lock:
+                if not self._prepared:
+                    prepare_upsert_table(
+                        self.engine, data, self.table_name, ["code", "date"]
+                    )
+                    self._prepared = True
+            with self.engine.begin() as connection:
+                merge_into_table(connection, data, self.table_name, ["code", "date"])
+                connection.execute(
+                    text(
+                        f"UPDATE `{self.info_name}` SET `updated_date` = :new_date "
+                        f"WHERE `code` = :code_val AND (`updated_date` IS NULL OR `updated_date` < :new_date)"
+                    ),
+                    {"new_date": max(data["date"]), "code_val": code},
+                )
+            with self._lock:
+                self.completed.append(code)
+            print(f"{code}: 已提交 {len(data)} 条数据, 最新日期 {max(data['date'])}")
+        except Exception as e:
+            with self._lock:
+                self.failed.append(code)
+            print(f"{code}: 写入失败, 已回滚: {e}")